@@ -0,0 +1,570 @@
+# Copyright (C) 2017 - Chenfeng Bao
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License; either version 3 of
+# the License, or (at your option) any later version.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses>.
+
+"""Offline benchmark for cleaner.py against a local stub Drive API server
+
+Run `python benchmark.py --help` for options. No Google account is needed.
+
+The stub server serves the Drive v3 endpoints used by cleaner.py
+(changes.getStartPageToken, changes.list, files.get, files.list,
+files.delete and batch requests) from a synthetic change list, and can
+inject latency, backend errors (500) and rate limit errors (403, 429).
+"""
+
+import argparse
+import email.parser
+import http.server
+import io
+import json
+import os
+import random
+import socketserver
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+
+import httplib2
+from googleapiclient import discovery
+from googleapiclient.discovery_cache import get_static_doc
+
+import cleaner
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+ROOT_ID = 'root0000000'
+
+class FakeDrive:
+    """In-memory state of the stub Drive server
+
+    numChanges:     Number of changes in the change list, one per file.
+    trashedRatio:   Fraction of files that are explicitly trashed.
+    numFolders:     Number of folders the files are placed in.
+    depth:          Maximum depth of the folder tree.
+    spanDays:       Changes are spread over this many days until now.
+    distribution:   Distribution of change times over spanDays. 'uniform',
+                    'recent' (denser towards now) or 'old' (denser towards
+                    spanDays ago).
+    latency:        Seconds to wait before answering each HTTP request.
+    errorRate:      Fraction of API calls failing with backend error (500).
+    rateLimitRate:  Fraction of API calls failing with rate limit errors
+                    (429, or 403 userRateLimitExceeded).
+    seed:           Random seed. Same arguments generate the same Drive.
+    """
+    def __init__(self, numChanges=10000, trashedRatio=0.3, numFolders=1000, depth=8,
+                 spanDays=365, distribution='uniform', latency=0.0, errorRate=0.0,
+                 rateLimitRate=0.0, seed=0):
+        self.latency = latency
+        self.errorRate = errorRate
+        self.rateLimitRate = rateLimitRate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.httpCalls = 0
+        self.apiCalls = 0
+        self.bytesSent = 0
+        self.files = {}
+        self.generate_folders(numFolders, depth)
+        self.generate_changes(numChanges, trashedRatio, spanDays, distribution)
+
+    def generate_folders(self, numFolders, depth):
+        self.files[ROOT_ID] = {'id': ROOT_ID, 'name': 'My Drive', 'mimeType': FOLDER_MIME_TYPE,
+                               'trashed': False}
+        levels = [[ROOT_ID]]
+        for i in range(numFolders):
+            # a chain down to the maximum depth first, then random levels
+            level = i+1 if i < depth else self.random.randint(1, len(levels)-1)
+            folderId = 'folder{:07d}'.format(i)
+            self.files[folderId] = {'id': folderId, 'name': 'Folder {}'.format(i),
+                                    'mimeType': FOLDER_MIME_TYPE, 'trashed': False,
+                                    'parents': [self.random.choice(levels[level-1])]}
+            if level == len(levels):
+                levels.append([])
+            levels[level].append(folderId)
+        self.folderIds = [id for level in levels for id in level]
+
+    def generate_changes(self, numChanges, trashedRatio, spanDays, distribution):
+        span = spanDays*24*3600
+        start = time.time() - span
+        offsets = []
+        for i in range(numChanges):
+            u = self.random.random()
+            if distribution == 'recent':
+                u = 1 - u*u
+            elif distribution == 'old':
+                u = u*u
+            offsets.append(u*span)
+        # change list is in ascending order of time; page token n is change n
+        self.changes = []
+        self.latest = {}
+        for i, offset in enumerate(sorted(offsets)):
+            fileId = 'file{:07d}'.format(i)
+            trashed = self.random.random() < trashedRatio
+            self.files[fileId] = {'id': fileId, 'name': 'File {}.txt'.format(i),
+                                  'mimeType': 'text/plain', 'trashed': trashed,
+                                  'explicitlyTrashed': trashed,
+                                  'ownedByMe': self.random.random() < 0.95,
+                                  'parents': [self.random.choice(self.folderIds)]}
+            self.latest[fileId] = len(self.changes)
+            self.changes.append((fileId, format_time(start + offset)))
+
+    def trashed_files(self):
+        """All explicitly trashed files owned by me, as a list of TrashedFile"""
+        return [cleaner.TrashedFile(fileId, changeTime, self.files[fileId]['name'])
+                    for fileId, changeTime in self.changes
+                    if fileId in self.files and self.files[fileId].get('explicitlyTrashed')
+                        and self.files[fileId].get('ownedByMe')]
+
+    def handle(self, method, path):
+        """Handle a single API call. Return (status, body)"""
+        with self.lock:
+            self.apiCalls += 1
+            u = self.random.random()
+        if u < self.errorRate:
+            return 500, {'error': {'code': 500, 'message': 'Backend Error'}}
+        if u < self.errorRate + self.rateLimitRate/2:
+            return 429, {'error': {'code': 429, 'message': 'Too Many Requests'}}
+        if u < self.errorRate + self.rateLimitRate:
+            return 403, {'error': {'code': 403, 'message': 'User Rate Limit Exceeded',
+                                   'errors': [{'reason': 'userRateLimitExceeded'}]}}
+        path, _, query = path.partition('?')
+        params = dict(urllib.parse.parse_qsl(query))
+        parts = [urllib.parse.unquote(part) for part in path.strip('/').split('/')]
+        if parts[:2] != ['drive', 'v3']:
+            return 404, {'error': {'code': 404, 'message': 'Unknown endpoint'}}
+        parts = parts[2:]
+        with self.lock:
+            if method == 'GET' and parts == ['changes', 'startPageToken']:
+                return 200, {'startPageToken': str(len(self.changes)+1)}
+            if method == 'GET' and parts == ['changes']:
+                return self.list_changes(params)
+            if method == 'GET' and parts == ['files']:
+                return self.list_files(params)
+            if method == 'GET' and len(parts) == 2 and parts[0] == 'files':
+                return self.get_file(parts[1])
+            if method == 'DELETE' and len(parts) == 2 and parts[0] == 'files':
+                return self.delete_file(parts[1])
+        return 404, {'error': {'code': 404, 'message': 'Unknown endpoint'}}
+
+    def list_changes(self, params):
+        pageToken = int(params['pageToken'])
+        pageSize = int(params.get('pageSize', 100))
+        includeRemoved = params.get('includeRemoved', 'true') == 'true'
+        changes = []
+        for i in range(pageToken-1, min(pageToken-1+pageSize, len(self.changes))):
+            fileId, changeTime = self.changes[i]
+            # only the latest change of each file is listed
+            if self.latest[fileId] != i:
+                continue
+            file = self.files.get(fileId)
+            if file is None:
+                if includeRemoved:
+                    changes.append({'fileId': fileId, 'removed': True, 'time': changeTime})
+                continue
+            change = {'fileId': fileId, 'removed': False, 'time': changeTime}
+            if 'file(' in params.get('fields', 'file('):
+                change['file'] = {key: file[key] for key in
+                                  ('name', 'parents', 'explicitlyTrashed', 'ownedByMe')}
+            changes.append(change)
+        response = {'changes': changes}
+        if pageToken-1+pageSize < len(self.changes):
+            response['nextPageToken'] = str(pageToken+pageSize)
+        else:
+            response['newStartPageToken'] = str(len(self.changes)+1)
+        return 200, response
+
+    def list_files(self, params):
+        query = params.get('q', '')
+        if query == "mimeType='{}'".format(FOLDER_MIME_TYPE):
+            files = [file for file in self.files.values()
+                        if file['mimeType'] == FOLDER_MIME_TYPE and file['id'] != ROOT_ID]
+        elif query == "trashed=true and 'me' in owners":
+            files = [file for file in self.files.values()
+                        if file['trashed'] and file.get('ownedByMe')]
+        elif query.endswith("' in parents and trashed=true"):
+            parentId = query[1:query.index("'", 1)]
+            files = [file for file in self.files.values()
+                        if file['trashed'] and parentId in file.get('parents', [])]
+        else:
+            files = list(self.files.values())
+        start = int(params.get('pageToken') or 0)
+        pageSize = int(params.get('pageSize', 100))
+        keys = ('id', 'name', 'parents', 'explicitlyTrashed')
+        response = {'files': [{key: file[key] for key in keys if key in file}
+                                for file in files[start:start+pageSize]]}
+        if start+pageSize < len(files):
+            response['nextPageToken'] = str(start+pageSize)
+        return 200, response
+
+    def get_file(self, fileId):
+        if fileId == 'root':
+            fileId = ROOT_ID
+        file = self.files.get(fileId)
+        if file is None:
+            return 404, {'error': {'code': 404, 'message': 'File not found: ' + fileId}}
+        keys = ('id', 'name', 'parents', 'trashed', 'explicitlyTrashed')
+        return 200, {key: file[key] for key in keys if key in file}
+
+    def delete_file(self, fileId):
+        if self.files.pop(fileId, None) is None:
+            return 404, {'error': {'code': 404, 'message': 'File not found: ' + fileId}}
+        # deletion is a new change at the end of the change list
+        self.latest[fileId] = len(self.changes)
+        self.changes.append((fileId, format_time(time.time())))
+        return 204, None
+
+class FakeDriveHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.serve()
+
+    def do_POST(self):
+        self.serve()
+
+    def do_DELETE(self):
+        self.serve()
+
+    def serve(self):
+        drive = self.server.drive
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        with drive.lock:
+            drive.httpCalls += 1
+        time.sleep(drive.latency)
+        if self.command == 'POST' and self.path.split('?')[0].startswith('/batch/'):
+            self.serve_batch(body)
+            return
+        status, content = drive.handle(self.command, self.path)
+        self.respond(status, content)
+
+    def serve_batch(self, body):
+        drive = self.server.drive
+        contentType = self.headers['Content-Type']
+        message = email.parser.BytesParser().parsebytes(
+                    b'Content-Type: ' + contentType.encode() + b'\r\n\r\n' + body)
+        boundary = 'batch_response_boundary'
+        out = []
+        for part in message.get_payload():
+            requestLine = part.get_payload().lstrip().split('\n', 1)[0].strip()
+            method, path = requestLine.split(' ')[:2]
+            status, content = drive.handle(method, path)
+            payload = json.dumps(content) if content is not None else ''
+            out.append('--{}\r\nContent-Type: application/http\r\n'
+                       'Content-ID: <response-{}>\r\n\r\n'
+                       'HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n'
+                       'Content-Length: {}\r\n\r\n{}\r\n'.format(
+                            boundary, part['Content-ID'].strip('<>'), status,
+                            self.responses.get(status, ('',))[0], len(payload), payload))
+        out.append('--{}--\r\n'.format(boundary))
+        data = ''.join(out).encode()
+        with drive.lock:
+            drive.bytesSent += len(data)
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/mixed; boundary=' + boundary)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def respond(self, status, content):
+        data = json.dumps(content).encode() if content is not None else b''
+        drive = self.server.drive
+        with drive.lock:
+            drive.bytesSent += len(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeDriveServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, drive):
+        super().__init__(('127.0.0.1', 0), FakeDriveHandler)
+        self.drive = drive
+        self.url = 'http://127.0.0.1:{}/'.format(self.server_address[1])
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+def format_time(unixTime):
+    """Format Unix time as RFC 3339 in UTC, like Drive API"""
+    return '{}.{:03d}Z'.format(time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(unixTime)),
+                               int(unixTime*1000) % 1000)
+
+def build_fake_service(url, backend='blocking'):
+    """Build a Drive v3 service object talking to the stub server at url"""
+    if backend == 'async':
+        return cleaner.AsyncDriveService(baseUrl=url + 'drive/v3/')
+    doc = json.loads(get_static_doc('drive', 'v3'))
+    doc['rootUrl'] = url
+    doc['baseUrl'] = url + doc['servicePath']
+    return discovery.build_from_document(doc, http=httplib2.Http())
+
+class StubCredentials:
+    """Credentials for the stub server, which doesn't check authorization. 
+    Lets cleaner.py give each of its threads an Http object"""
+    def authorize(self, http):
+        return http
+
+def close_service(service):
+    if isinstance(service, cleaner.AsyncDriveService):
+        service.close()
+
+def make_flags(**kwargs):
+    flags = argparse.Namespace(auto=True, view=False, days=30, quiet=True,
+                timeout=cleaner.TIMEOUT_DEFAULT, mydriveonly=False, noprogress=True,
+                fullpath=False, batch=False, workers=1, stream=False, prefetch=1,
+                seek=0, prefilter=False, index=False, journal=False, backend='blocking',
+                format='text', spill=None, foldertree=False, pathcache=False, logfile=None,
+                ptokenfile=None, credfile=None, discoveryfile=None,
+                accounts=None, maxaccounts=cleaner.MAX_ACCOUNTS_DEFAULT)
+    for key, value in kwargs.items():
+        setattr(flags, key, value)
+    return flags
+
+class Result:
+    """Measurements of one benchmark"""
+    def __init__(self, name, seconds, httpCalls, apiCalls, bytesSent, peakMemory, items,
+                 error=None):
+        self.name = name
+        self.seconds = seconds
+        self.httpCalls = httpCalls
+        self.apiCalls = apiCalls
+        self.bytesSent = bytesSent
+        self.peakMemory = peakMemory
+        self.items = items
+        self.error = error
+
+def measure(name, drive, function, trace=False):
+    """Run function() and measure wall time, calls to drive and response bytes. 
+    function() returns the number of items processed. If it raises an 
+    exception, the exception is recorded in the result instead.
+    
+    trace:  Also measure peak memory allocated by Python, with tracemalloc. 
+            It slows Python down, so wall time is only meaningful without.
+            Peak memory includes allocations of the stub server threads, 
+            which are small and short-lived compared to cleaner.py's.
+    """
+    httpCalls, apiCalls, bytesSent = drive.httpCalls, drive.apiCalls, drive.bytesSent
+    peakMemory = items = error = None
+    # discard cleaner.py's console output in this thread
+    cleaner.safePrinter.redirect(io.StringIO())
+    if trace:
+        tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        try:
+            items = function()
+        except Exception as e:
+            error = '{}: {}'.format(type(e).__name__, e)
+        elapsed = time.perf_counter() - start
+        if trace:
+            peakMemory = tracemalloc.get_traced_memory()[1]
+    finally:
+        if trace:
+            tracemalloc.stop()
+        cleaner.safePrinter.redirect(None)
+    return Result(name, elapsed, drive.httpCalls - httpCalls, drive.apiCalls - apiCalls,
+                  drive.bytesSent - bytesSent, peakMemory, items, error)
+
+def bench_scan(args, trace, name, **flagKwargs):
+    """Time get_deletion_list() from the start of the change list"""
+    drive = new_drive(args)
+    flags = make_flags(days=args.days, **flagKwargs)
+    with FakeDriveServer(drive) as server:
+        service = build_fake_service(server.url, flags.backend)
+        try:
+            return [measure(name, drive, lambda: len(
+                        cleaner.get_deletion_list(service, 1, flags,
+                                                  credentials=StubCredentials())[0]), trace)]
+        finally:
+            close_service(service)
+
+def bench_index(args, trace, name, runs):
+    """Time get_indexed_deletion_list() `runs` times on the same index"""
+    drive = new_drive(args)
+    flags = make_flags(days=args.days, view=True, index=True)
+    results = []
+    with FakeDriveServer(drive) as server, tempfile.TemporaryDirectory() as folder:
+        service = build_fake_service(server.url)
+        scanIndex = cleaner.ScanIndex(os.path.join(folder, 'page_token' + cleaner.INDEX_FILE_SUFFIX))
+        for run in range(runs):
+            results.append(measure('{} #{}'.format(name, run+1), drive, lambda: len(
+                cleaner.get_indexed_deletion_list(service, scanIndex, 1, flags,
+                                                  credentials=StubCredentials())[0]), trace))
+        scanIndex.conn.close()
+    return results
+
+def bench_paths(args, trace, name, mode):
+    """Time PathFinder on all trashed files in pages of the change list
+    
+    mode:   'lazy' to query parents one by one in get_path(), 'bulk' to 
+            prefetch() each page first, or 'tree' to load_folder_tree().
+    """
+    drive = new_drive(args)
+    fileResList = [(item.fileId, {'name': item.name,
+                                  'parents': drive.files[item.fileId]['parents']})
+                        for item in drive.trashed_files()]
+    def run():
+        pathFinder = cleaner.PathFinder(service)
+        if mode == 'tree':
+            pathFinder.load_folder_tree()
+        for start in range(0, len(fileResList), cleaner.PAGE_SIZE_LARGE):
+            page = fileResList[start:start+cleaner.PAGE_SIZE_LARGE]
+            if mode == 'bulk':
+                pathFinder.prefetch(fileRes for _, fileRes in page)
+            for fileId, fileRes in page:
+                pathFinder.get_path(fileId, fileRes=fileRes)
+        return len(fileResList)
+    with FakeDriveServer(drive) as server:
+        service = build_fake_service(server.url)
+        return [measure(name, drive, run, trace)]
+
+def bench_delete(args, trace, name, **flagKwargs):
+    """Time delete_old_files() on all trashed files"""
+    drive = new_drive(args)
+    deletionList = drive.trashed_files()
+    flags = make_flags(**flagKwargs)
+    with FakeDriveServer(drive) as server:
+        service = build_fake_service(server.url, flags.backend)
+        try:
+            result = measure(name, drive, lambda: (
+                    cleaner.delete_old_files(service, deletionList, flags, StubCredentials()),
+                    len(deletionList))[1],
+                    trace)
+        finally:
+            close_service(service)
+    left = sum(1 for item in deletionList if item.fileId in drive.files)
+    assert left == 0 or result.error, '{} files not deleted'.format(left)
+    return [result]
+
+def bench(args, function, *funcArgs, **funcKwargs):
+    """Run benchmark function, then again with tracemalloc for peak memory 
+    unless --nomemory. Return list of Result's"""
+    results = function(args, False, *funcArgs, **funcKwargs)
+    if args.memory:
+        traced = function(args, True, *funcArgs, **funcKwargs)
+        for result, tracedResult in zip(results, traced):
+            result.peakMemory = tracedResult.peakMemory
+    return results
+
+def new_drive(args):
+    return FakeDrive(args.changes, args.trashed, args.folders, args.depth, args.span,
+                     args.distribution, args.latency, args.errors, args.ratelimits, args.seed)
+
+def run_suite(suite, args):
+    """Run benchmarks of suite. Generate Result's"""
+    backends = ['blocking', 'async'] if cleaner.aiohttp else ['blocking']
+    if suite == 'scan':
+        yield from bench(args, bench_scan, 'scan', prefetch=0)
+        yield from bench(args, bench_scan, 'scan --prefetch 1', prefetch=1)
+        yield from bench(args, bench_scan, 'scan --seek {}'.format(args.workers),
+                         seek=args.workers)
+        yield from bench(args, bench_scan, 'scan --prefilter', prefilter=True)
+        yield from bench(args, bench_scan, 'scan --spill 1000', spill=1000)
+        yield from bench(args, bench_scan, 'scan --fullpath', fullpath=True)
+        yield from bench(args, bench_scan, 'scan --fullpath --foldertree',
+                         fullpath=True, foldertree=True)
+        if 'async' in backends:
+            yield from bench(args, bench_scan, 'scan --backend async', backend='async')
+    elif suite == 'index':
+        yield from bench(args, bench_index, 'scan --index', 2)
+    elif suite == 'paths':
+        for mode in ('lazy', 'bulk', 'tree'):
+            yield from bench(args, bench_paths, 'PathFinder ' + mode, mode)
+    elif suite == 'delete':
+        for backend in backends:
+            suffix = '' if backend == 'blocking' else ' --backend ' + backend
+            yield from bench(args, bench_delete, 'delete' + suffix, backend=backend)
+            yield from bench(args, bench_delete, 'delete --batch' + suffix,
+                             backend=backend, batch=True)
+            yield from bench(args, bench_delete, 'delete --workers {}{}'.format(
+                                args.workers, suffix), backend=backend, workers=args.workers)
+        if args.errors or args.ratelimits:
+            # show the rate limiter's ramp-up against the sequential loop
+            noErrors = argparse.Namespace(**dict(vars(args), errors=0.0, ratelimits=0.0))
+            yield from bench(noErrors, bench_delete, 'delete, no errors')
+            yield from bench(noErrors, bench_delete, 'delete --workers {}, no errors'.format(
+                                args.workers), workers=args.workers)
+
+SUITES = ('scan', 'index', 'paths', 'delete')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('suites', nargs='*', metavar='SUITE',
+            help='Benchmarks to run: {}. Default is all'.format(', '.join(SUITES)))
+    parser.add_argument('-n', '--changes', type=int, default=10000,
+            help='Number of changes (files) in the change list. Default is %(default)s')
+    parser.add_argument('--trashed', type=float, default=0.3, metavar='RATIO',
+            help='Fraction of files that are trashed. Default is %(default)s')
+    parser.add_argument('--folders', type=int, default=1000, metavar='N',
+            help='Number of folders. Default is %(default)s')
+    parser.add_argument('--depth', type=int, default=8, metavar='N',
+            help='Maximum depth of the folder tree. Default is %(default)s')
+    parser.add_argument('--span', type=int, default=365, metavar='DAYS',
+            help='Changes are spread over this many days until now. Default is %(default)s')
+    parser.add_argument('--distribution', choices=['uniform', 'recent', 'old'],
+            default='uniform', help='Distribution of change times. Default is %(default)s')
+    parser.add_argument('-d', '--days', type=int, default=30,
+            help='Maximum days in trash, as in cleaner.py. Default is %(default)s')
+    parser.add_argument('-l', '--latency', type=float, default=0.01, metavar='SECS',
+            help='Simulated round trip latency per HTTP request. Default is %(default)s')
+    parser.add_argument('--errors', type=float, default=0.0, metavar='RATE',
+            help='Fraction of API calls failing with backend error. Default is %(default)s')
+    parser.add_argument('--ratelimits', type=float, default=0.0, metavar='RATE',
+            help='Fraction of API calls failing with rate limit errors. '
+                 'Default is %(default)s')
+    parser.add_argument('--retryinterval', type=float, default=cleaner.RETRY_INTERVAL,
+            metavar='SECS', help='Seconds between retries of failed API calls. '
+                                 'Default is %(default)s')
+    parser.add_argument('-w', '--workers', type=int, default=8,
+            help='Number of threads for concurrent deletion, and of ranges for --seek. '
+                 'Default is %(default)s')
+    parser.add_argument('--seed', type=int, default=0,
+            help='Random seed of the synthetic Drive. Default is %(default)s')
+    parser.add_argument('--nomemory', action='store_false', dest='memory',
+            help="Don't measure peak memory, which takes a second run of each benchmark")
+    parser.add_argument('--json', metavar='PATH',
+            help='Also write results to PATH in JSON, e.g. to compare runs')
+    args = parser.parse_args()
+    for suite in args.suites:
+        if suite not in SUITES:
+            parser.error('unknown suite {!r}; choose from {}'.format(suite, ', '.join(SUITES)))
+    cleaner.RETRY_INTERVAL = args.retryinterval
+    print('{} changes, {:.0%} trashed, {} folders up to depth {}, {:.0f} ms latency'.format(
+            args.changes, args.trashed, args.folders, args.depth, args.latency*1000))
+    print('{:<36}{:>9}{:>8}{:>8}{:>9}{:>10}{:>8}'.format(
+            'Benchmark', 'Seconds', 'HTTP', 'API', 'KiB', 'Peak MiB', 'Items'))
+    results = []
+    for suite in args.suites or SUITES:
+        for result in run_suite(suite, args):
+            memory = '-' if result.peakMemory is None else \
+                     '{:.1f}'.format(result.peakMemory/2**20)
+            print('{:<36}{:>9.2f}{:>8}{:>8}{:>9.0f}{:>10}{:>8}'.format(
+                    result.name, result.seconds, result.httpCalls, result.apiCalls,
+                    result.bytesSent/1024, memory, '-' if result.items is None else result.items))
+            if result.error:
+                print('  failed with ' + result.error.splitlines()[0])
+            results.append(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'results': [vars(result) for result in results]},
+                      f, indent=2)
+
+if __name__ == '__main__':
+    main()
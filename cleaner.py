@@ -16,12 +16,37 @@ import time
 import calendar
 import logging
 import warnings
+import json
+import threading
+import queue
+import sqlite3
+import collections
+import configparser
+import copy
+import itertools
+import csv
+import tempfile
+import asyncio
+import contextlib
+import cProfile
+import signal
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import quote
 
 from apiclient import discovery
 from apiclient.errors import HttpError
+try:
+    from googleapiclient.discovery_cache import get_static_doc
+except ImportError:
+    # google-api-python-client 1.x doesn't ship discovery documents
+    get_static_doc = None
 from oauth2client import client
 from oauth2client import tools
 from oauth2client.file import Storage
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
 
 if getattr(sys, 'frozen', False):
     # running in a bundle
@@ -30,6 +55,10 @@ else:
     # running as a normal Python script
     CLEANER_PATH = os.path.realpath(__file__)
 PAGE_TOKEN_FILE = os.path.join(os.path.dirname(CLEANER_PATH), 'page_token')
+DISCOVERY_FILE = os.path.join(os.path.dirname(CLEANER_PATH), 'drive_v3_discovery.json')
+INDEX_FILE_SUFFIX = '.db'
+PATH_CACHE_SUFFIX = '.paths'
+JOURNAL_SUFFIX = '.journal'
 CREDENTIAL_FILE = os.path.join(os.path.expanduser('~'), '.credentials', 'google-drive-trash-cleaner.json')
 
 CLIENT_CREDENTIAL = {
@@ -43,12 +72,30 @@ CLIENT_CREDENTIAL = {
     "pkce" : True
 }
 
+DISCOVERY_URL = 'https://www.googleapis.com/discovery/v1/apis/drive/v3/rest'
+DISCOVERY_TTL = 24*3600
+DRIVE_API_URL = 'https://www.googleapis.com/drive/v3/'
+
 PAGE_SIZE_LARGE = 1000
 PAGE_SIZE_SMALL = 100
 PAGE_SIZE_SWITCH_THRESHOLD = 3000
 RETRY_NUM = 3
 RETRY_INTERVAL = 2
 TIMEOUT_DEFAULT = 300
+BATCH_SIZE = 100
+RATE_INITIAL = 50
+RATE_MIN = 0.5
+RATE_MAX = 1000
+RATE_STEP = 10
+STREAM_QUEUE_SIZE = 4
+PATH_CACHE_SIZE = 100000
+MAX_ACCOUNTS_DEFAULT = 4
+ASYNC_CONCURRENCY = 10
+PROGRESS_INTERVAL = 0.2
+OUTPUT_BLOCK_SIZE = 1000
+JOURNAL_SYNC_SIZE = 100
+LATENCY_BUCKETS = (0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10)
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
 
 class TimeoutError(Exception):
     pass
@@ -56,18 +103,28 @@ class TimeoutError(Exception):
 class PageTokenFile:
     def __init__(self, filePath):
         self.path = filePath
+        self.pageToken = None   # last page token read or saved
     
     def get(self):
+        if self.pageToken is not None:
+            return self.pageToken
         try:
             with open(self.path, 'r', encoding='utf-8') as f:
                 pageToken = int(f.read())
         except (FileNotFoundError, ValueError):
             pageToken = 0
+        self.pageToken = pageToken
         return pageToken
     
     def save(self, pageToken):
-        with open(self.path, 'w', encoding='utf-8') as f:
+        """Save page token to file, replacing it atomically"""
+        tempPath = self.path + '.tmp'
+        with open(tempPath, 'w', encoding='utf-8') as f:
             f.write(str(pageToken))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tempPath, self.path)
+        self.pageToken = pageToken
 
 class SafePrinter:
     class _SafeTextWrapper:
@@ -75,8 +132,18 @@ class SafePrinter:
             if not isinstance(unsafeTextFile, io.TextIOBase):
                 raise TypeError()
             self.unsafeTextFile = unsafeTextFile
-            self.encoding = unsafeTextFile.encoding
+            self.encoding = unsafeTextFile.encoding or 'utf-8'
             self.error = error
+            if unsafeTextFile.encoding is None:
+                # in-memory text file, nothing to encode
+                self.write = unsafeTextFile.write
+            elif hasattr(unsafeTextFile, 'reconfigure'):
+                # let the stream replace unencodable characters as it encodes
+                try:
+                    unsafeTextFile.reconfigure(errors=error)
+                    self.write = unsafeTextFile.write
+                except (ValueError, io.UnsupportedOperation):
+                    pass
         def write(self, text):
             self.unsafeTextFile.write(text.encode(self.encoding, self.error).decode(self.encoding, 'ignore'))
         def flush(self):
@@ -88,16 +155,39 @@ class SafePrinter:
         self.defaultFile = defaultFile or sys.stdout
         self.error = error
         self.wrappers = {id(self.defaultFile): SafePrinter._SafeTextWrapper(self.defaultFile, self.error)}
+        self.local = threading.local()
     
     def get_print(self):
         def print(*args, **kwargs):
-            file = kwargs.get('file') or self.defaultFile
+            file = kwargs.get('file') or getattr(self.local, 'file', None) or self.defaultFile
             if id(file) not in self.wrappers:
                 self.wrappers[id(file)] = SafePrinter._SafeTextWrapper(file, self.error)
             kwargs['file'] = self.wrappers[id(file)]
             builtins.print(*args, **kwargs)
         return print
     
+    def redirect(self, file):
+        """Redirect default output of the current thread to file. 
+        None to restore"""
+        self.local.file = file
+    
+    def inherit(self, function):
+        """Wrap function to print to the current thread's redirected output, 
+        in whichever thread it's called"""
+        file = getattr(self.local, 'file', None)
+        def wrapper(*args, **kwargs):
+            previous = getattr(self.local, 'file', None)
+            self.local.file = file
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.local.file = previous
+        return wrapper
+    
+    def set_default(self, file):
+        """Change default output of all threads not redirected"""
+        self.defaultFile = file
+    
     def clear(self):
         delList = []
         for id in self.wrappers:
@@ -111,40 +201,361 @@ class SafePrinter:
         self.wrappers = {id(self.defaultFile): SafePrinter._SafeTextWrapper(self.defaultFile, self.error)}
 
 try:
-    print = SafePrinter().get_print()
+    safePrinter = SafePrinter()
+    print = safePrinter.get_print()
 except TypeError:
     sys.stderr.write('`SafePrinter` failed to initialize. Please contact the developer.\n')
     sys.exit(-1)
 
+class RunStats:
+    """Counters and timers of API calls, retries and phases of a run
+    
+    Thread-safe. The module-level instance `stats` collects from all threads 
+    and accounts, and is written to the file specified by --statsjson.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self.lock:
+            self.startTime = time.time()
+            self.endpoints = {}     # methodId: counters of API calls
+            self.retries = {}       # reason: number of retried requests
+            self.retrySleep = 0.0
+            self.throttleSleep = 0.0
+            self.phases = {}        # name: [times entered, seconds]
+            self.local = threading.local()
+    
+    def record_call(self, endpoint, seconds=None, error=None):
+        """Count an API call to endpoint (request.methodId)
+        
+        seconds:    Round trip time, added to the latency histogram. None 
+                    for requests in a batch, whose time is recorded for the 
+                    'batch' endpoint.
+        error:      HTTP status or exception type name if the call failed.
+        """
+        with self.lock:
+            counters = self.endpoints.get(endpoint)
+            if counters is None:
+                counters = self.endpoints[endpoint] = {
+                        'calls': 0, 'errors': {}, 'seconds': 0.0,
+                        'latency': [0] * (len(LATENCY_BUCKETS) + 1)}
+            counters['calls'] += 1
+            if error is not None:
+                counters['errors'][str(error)] = counters['errors'].get(str(error), 0) + 1
+            if seconds is not None:
+                counters['seconds'] += seconds
+                bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound),
+                              len(LATENCY_BUCKETS))
+                counters['latency'][bucket] += 1
+    
+    def record_retry(self, reason, sleep=0.0, count=1):
+        """Count `count` requests retried due to reason after sleeping"""
+        with self.lock:
+            self.retries[reason] = self.retries.get(reason, 0) + count
+            self.retrySleep += sleep
+    
+    def record_throttle(self, sleep):
+        with self.lock:
+            self.throttleSleep += sleep
+    
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time a phase of the run. Also usable as a function decorator
+        
+        Nested or recursive entries of the same phase in the same thread 
+        are only timed once. Phases in different threads may overlap.
+        """
+        active = self.local.__dict__.setdefault('phases', set())
+        if name in active:
+            yield
+            return
+        active.add(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            active.discard(name)
+            with self.lock:
+                entry = self.phases.setdefault(name, [0, 0.0])
+                entry[0] += 1
+                entry[1] += seconds
+    
+    def report(self, summaries=None):
+        """Return all stats as a JSON-serializable dictionary
+        
+        summaries:  Dictionary of account name: CleanSummary to include.
+        """
+        bucketNames = ['<={}'.format(bound) for bound in LATENCY_BUCKETS] + \
+                      ['>{}'.format(LATENCY_BUCKETS[-1])]
+        with self.lock:
+            endpoints = {}
+            for endpoint, counters in sorted(self.endpoints.items()):
+                endpoints[endpoint] = {
+                        'calls': counters['calls'],
+                        'errors': dict(counters['errors']),
+                        'seconds': round(counters['seconds'], 6),
+                        'latency': dict(zip(bucketNames, counters['latency']))}
+            return {
+                'elapsed': round(time.time() - self.startTime, 3),
+                'phases': {name: {'count': count, 'seconds': round(seconds, 6)}
+                            for name, (count, seconds) in sorted(self.phases.items())},
+                'endpoints': endpoints,
+                # requests in batches are counted by their own endpoints
+                'apiCalls': sum(counters['calls'] for endpoint, counters
+                                    in self.endpoints.items() if endpoint != 'batch'),
+                'retries': dict(self.retries),
+                'retrySleep': round(self.retrySleep, 3),
+                'throttleSleep': round(self.throttleSleep, 3),
+                'accounts': {name: vars(summary) for name, summary in (summaries or {}).items()},
+            }
+    
+    def save(self, path, summaries=None):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(summaries), f, indent=2)
+
+stats = RunStats()
+
 def main():
     flags = parse_cmdline()
     logger = configure_logs(flags.logfile)
-    pageTokenFile = PageTokenFile(flags.ptokenfile)
+    profiler = cProfile.Profile() if flags.profile else None
+    summaries = {}
+    if flags.format != 'text':
+        # keep stdout for the listing, including output of other threads
+        safePrinter.set_default(sys.stderr)
+    if profiler:
+        profiler.enable()
+    try:
+        if flags.accounts:
+            summaries = clean_accounts(flags.accounts, flags.maxaccounts)
+        elif flags.watch:
+            summaries['default'] = watch(flags)
+        else:
+            summaries['default'] = clean(flags)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(flags.profile)
+        if flags.statsjson:
+            stats.save(flags.statsjson, summaries)
+
+def clean(flags, summary=None, state=None):
+    """Scan for and delete old trashed files of the account specified by flags
+    
+    summary:    CleanSummary to record the counts of this run in.
+    state:      CleanState to reuse and keep objects in for the next run. 
+                The caller closes it. By default, a new one is used and 
+                closed at the end.
+    """
+    startTime = time.time()
+    summary = summary or CleanSummary()
+    ownState = state is None
+    state = state or CleanState()
+    if not state.pageTokenFile:
+        state.pageTokenFile = PageTokenFile(flags.ptokenfile)
+    pageTokenFile = state.pageTokenFile
+    pathFinder = None
+    deletionList = None
+    listEmpty = False
+    if flags.index and not state.scanIndex:
+        state.scanIndex = ScanIndex(flags.ptokenfile + INDEX_FILE_SUFFIX, flags.mydriveonly)
+    scanIndex = state.scanIndex
+    journal = None
+    if flags.journal:
+        journal = DeletionJournal(flags.ptokenfile + JOURNAL_SUFFIX)
     for i in range(RETRY_NUM):
         try:
-            service = build_service(flags)
+            with stats.phase('setup'):
+                if not state.credentials:
+                    state.credentials = get_credentials(flags)
+                    # reuse the same Http and its connection for retries
+                    state.http = state.credentials.authorize(httplib2.Http())
+                credentials = state.credentials
+                http = state.http
+                if not state.service and flags.backend == 'async':
+                    state.service = AsyncDriveService(credentials, timeout=flags.timeout)
+                elif not state.service:
+                    state.service = build_service(http, flags.discoveryfile)
+            service = state.service
+            if flags.fullpath and not state.pathFinder:
+                state.pathFinder = create_path_finder(service, flags)
+            pathFinder = state.pathFinder
+            if flags.stream:
+                # page token file is updated by stream_delete() as it goes
+                stream_delete(service, pageTokenFile, flags, pathFinder, credentials, summary)
+                break
+            if journal and not flags.view:
+                resume_deletion(service, journal, pageTokenFile, flags, credentials,
+                                summary, scanIndex)
             pageToken = pageTokenFile.get()
-            deletionList, pageTokenBefore, pageTokenAfter = \
-                get_deletion_list(service, pageToken, flags)
+            if scanIndex:
+                deletionList, pageTokenBefore, pageTokenAfter = \
+                    get_indexed_deletion_list(service, scanIndex, pageToken, flags,
+                                              pathFinder, credentials, summary)
+            else:
+                deletionList, pageTokenBefore, pageTokenAfter = \
+                    get_deletion_list(service, pageToken, flags, pathFinder, credentials,
+                                      summary)
             pageTokenFile.save(pageTokenBefore)
-            listEmpty = delete_old_files(service, deletionList, flags)
+            listEmpty = delete_old_files(service, deletionList, flags, credentials, summary,
+                                         journal, pageTokenAfter)
         except client.HttpAccessTokenRefreshError:
             print('Authentication error')
+            stats.record_retry('authError', RETRY_INTERVAL)
         except httplib2.ServerNotFoundError as e:
             print('Error:', e)
+            stats.record_retry('serverNotFound', RETRY_INTERVAL)
         except TimeoutError:
             print('Timeout: Google backend error.')
             print('Retries unsuccessful. Abort action.')
-            return
+            summary.error = 'Timeout'
+            break
         else:
             break
         time.sleep(RETRY_INTERVAL)
     else:
         print("Retries unsuccessful. Abort action.")
-        return
+        summary.error = 'Retries unsuccessful'
+    if ownState:
+        state.close()
+    summary.elapsed = time.time() - startTime
+    if summary.error:
+        summary.failed = summary.found - summary.deleted
+        if deletionList is not None:
+            deletionList.close()
+        if journal:
+            journal.close()
+        return summary
     
+    if pathFinder and flags.pathcache:
+        pathFinder.save(flags.ptokenfile + PATH_CACHE_SUFFIX)
     if listEmpty:
         pageTokenFile.save(pageTokenAfter)
+        if scanIndex:
+            scanIndex.remove(item.fileId for item in deletionList)
+        if journal:
+            journal.finish()
+    if deletionList is not None:
+        deletionList.close()
+    return summary
+
+def watch(flags):
+    """Run clean() every flags.watch seconds, keeping its state in between
+    
+    Stop after the current run on SIGINT or SIGTERM, or right away on a 
+    second one. Errors of a run are printed and recorded in its summary, 
+    and the next run goes ahead as usual. Return a CleanSummary of all runs.
+    """
+    stop = threading.Event()
+    def handle_signal(signum, frame):
+        if stop.is_set():
+            raise KeyboardInterrupt
+        print('Stopping...')
+        stop.set()
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+    state = CleanState()
+    total = CleanSummary()
+    try:
+        while not stop.is_set():
+            print(time.strftime('[%Y-%m-%d %H:%M:%S]'))
+            summary = CleanSummary()
+            try:
+                clean(flags, summary, state)
+            except Exception as e:
+                print('Error:', e)
+                summary.error = str(e) or type(e).__name__
+                summary.failed = summary.found - summary.deleted
+            total.add(summary)
+            stop.wait(flags.watch)
+    finally:
+        state.close()
+    return total
+
+def clean_accounts(accounts, maxAccounts=MAX_ACCOUNTS_DEFAULT):
+    """Clean multiple accounts concurrently, at most maxAccounts at a time
+    
+    accounts:   List of (name, flags) for each account, as returned by 
+                read_accounts().
+    Output of each account is printed once it's finished, followed by a 
+    summary of all accounts.
+    Return a dictionary of account name: CleanSummary.
+    """
+    for name, flags in accounts:
+        # authorize one by one, as user interaction may be needed
+        try:
+            get_credentials(flags)
+        except Exception:
+            # reported when cleaning this account
+            pass
+    def run(name, flags):
+        output = io.StringIO()
+        safePrinter.redirect(output)
+        summary = CleanSummary()
+        try:
+            clean(flags, summary)
+        except Exception as e:
+            print('Error:', e)
+            summary.error = str(e) or type(e).__name__
+            summary.failed = summary.found - summary.deleted
+        finally:
+            safePrinter.redirect(None)
+        return summary, output.getvalue()
+    summaries = {}
+    with ThreadPoolExecutor(maxAccounts) as executor:
+        futures = {executor.submit(run, name, flags): name for name, flags in accounts}
+        for future in as_completed(futures):
+            name = futures[future]
+            summaries[name], output = future.result()
+            print('[{}]'.format(name))
+            print(output, end='')
+    print()
+    print('Account'.ljust(24) + 'Scanned'.rjust(10) + 'Deleted'.rjust(10) +
+          'Failed'.rjust(10) + 'Time'.rjust(10))
+    for name, flags in accounts:
+        summary = summaries[name]
+        print(name[:23].ljust(24) + '{:>10}{:>10}{:>10}{:>9.1f}s'.format(
+                summary.scanned, summary.deleted, summary.failed, summary.elapsed) +
+              ('    ' + summary.error if summary.error else ''))
+    return summaries
+
+class CleanSummary:
+    """Counts of files in a run of clean()"""
+    def __init__(self):
+        self.scanned = 0    # changes scanned
+        self.found = 0      # files to be deleted
+        self.deleted = 0
+        self.failed = 0     # files to be deleted but not deleted due to errors
+        self.elapsed = 0.0
+        self.error = None
+    
+    def add(self, other):
+        """Add counts of another run, keeping its error if any"""
+        self.scanned += other.scanned
+        self.found += other.found
+        self.deleted += other.deleted
+        self.failed += other.failed
+        self.elapsed += other.elapsed
+        self.error = other.error
+
+class CleanState:
+    """Objects used by clean(), which can be kept for the next run of the 
+    same account, as in --watch mode"""
+    def __init__(self):
+        self.credentials = None
+        self.http = None
+        self.service = None
+        self.pathFinder = None
+        self.pageTokenFile = None
+        self.scanIndex = None
+    
+    def close(self):
+        if isinstance(self.service, AsyncDriveService):
+            self.service.close()
+        self.service = None
 
 def parse_cmdline():
     parser = argparse.ArgumentParser()
@@ -169,6 +580,40 @@ def parse_cmdline():
             help='Specify timeout period in seconds. Default is %(default)s')
     parser.add_argument('-m', '--mydriveonly', action='store_true',
             help="Only delete files in the 'My Drive' hierarchy, excluding those in 'Computers' etc.")
+    parser.add_argument('-b', '--batch', action='store_true',
+            help="Delete files in batches of up to {} per HTTP request. "
+                "Much faster for a large number of files.".format(BATCH_SIZE))
+    parser.add_argument('-w', '--workers', action='store', type=int, default=1, metavar='N',
+            help="Delete files concurrently in N threads, throttled to avoid "
+                "exceeding Google API rate limits. Default is %(default)s")
+    parser.add_argument('-s', '--stream', action='store_true',
+            help="Delete files while scanning for them, instead of after scanning. "
+                "Requires --auto")
+    parser.add_argument('--prefetch', action='store', type=int, default=1, metavar='N',
+            help="Fetch up to N pages of Drive activity history ahead while scanning. "
+                "Default is %(default)s")
+    parser.add_argument('--seek', action='store', type=int, default=0, metavar='N',
+            help="Locate the end of the scan in Drive activity history by binary search, "
+                "and scan up to it in N ranges concurrently. Faster for a long history, "
+                "e.g. on first run. Default is %(default)s, scanning one page after another")
+    parser.add_argument('--prefilter', action='store_true',
+            help="List files in trash first, then scan Drive activity history only for "
+                "when they were trashed, stopping once all are found. Faster if there "
+                "are few files in trash compared to other activity.")
+    parser.add_argument('--spill', action='store', type=int, metavar='N',
+            help="Keep the list of files to be deleted in a temporary file on disk "
+                "once it exceeds N files, to limit memory use. Default is to keep it "
+                "in memory")
+    parser.add_argument('-i', '--index', action='store_true',
+            help="Keep an index of trashed files in a database file next to the page token file, "
+                "so later scans only check Drive activity since the last scan.")
+    parser.add_argument('--backend', action='store', choices=['blocking', 'async'], default='blocking',
+            help="Send Google API requests with blocking httplib2 or with asyncio and aiohttp, "
+                "up to {} requests at a time. Default is %(default)s".format(ASYNC_CONCURRENCY))
+    parser.add_argument('--format', action='store', choices=['text', 'jsonl', 'csv'], default='text',
+            help="Format of the list of files to be deleted. jsonl and csv list them on "
+                "stdout for other programs, with all other output on stderr. "
+                "Requires --auto or --view. Default is %(default)s")
     parser.add_argument('--noprogress', action='store_true',
             help="Don't show scanning progress. Useful when directing output to files.")
     parser.add_argument('--fullpath', action='store_true',
@@ -176,29 +621,147 @@ def parse_cmdline():
                 "NOTE: the path shown is the 'current' path, "
                 "may be different from the original path (when trashing) "
                 "if the original parent folder has moved.")
+    parser.add_argument('--foldertree', action='store_true',
+            help="With --fullpath, list all folders in Google Drive before scanning. "
+                "Faster if trashed files are spread over many folders.")
+    parser.add_argument('--pathcache', action='store_true',
+            help="With --fullpath, keep found folder paths in a cache file next to the "
+                "page token file for future runs. Folders renamed or moved within "
+                "the last # days (see --days) may show their old path, unless "
+                "--index is also used.")
     parser.add_argument('--logfile', action='store', metavar='PATH',
             help='Path to log file. Default is no logs')
+    parser.add_argument('--statsjson', action='store', metavar='PATH',
+            help="Write statistics of the run to PATH in JSON: API calls and latency "
+                "per endpoint, retries, and time spent in each phase")
+    parser.add_argument('--profile', action='store', metavar='PATH',
+            help="Profile the main thread with cProfile and dump the results to PATH, "
+                "to be read with the pstats module")
+    parser.add_argument('--journal', action='store_true',
+            help="Record files being deleted in a journal file next to the page token "
+                "file, so deletion interrupted by a crash or Ctrl+C is finished on the "
+                "next run without scanning again.")
+    parser.add_argument('--watch', action='store', type=int, metavar='SECS',
+            help="Keep running, scanning for and deleting old trashed files every SECS "
+                "seconds till interrupted. Only Drive activity since the last scan is "
+                "checked each time. Requires --auto")
     parser.add_argument('--ptokenfile', action='store', default=PAGE_TOKEN_FILE, metavar='PATH',
             help="Path to page token file. Default is \"{}\" in %(prog)s's parent folder".
                     format(os.path.basename(PAGE_TOKEN_FILE)))
     parser.add_argument('--credfile', action='store', default=CREDENTIAL_FILE, metavar='PATH',
             help="Path to OAuth2Credentials file. Default is %(default)s")
+    parser.add_argument('--discoveryfile', action='store', default=DISCOVERY_FILE, metavar='PATH',
+            help="Path to cache Google Drive API discovery document at, if the Google API "
+                 "client library doesn't include it. Default is \"{}\" "
+                 "in %(prog)s's parent folder".format(os.path.basename(DISCOVERY_FILE)))
+    parser.add_argument('--accounts', action='store', metavar='PATH',
+            help="Path to a file listing multiple accounts to clean concurrently. "
+                "Each [section] is an account, with 'credfile', 'ptokenfile' and "
+                "optionally 'days'. Requires --auto or --view")
+    parser.add_argument('--maxaccounts', action='store', type=int, default=MAX_ACCOUNTS_DEFAULT,
+            metavar='N', help="Clean at most N accounts at a time with --accounts. "
+                "Default is %(default)s")
     flags = parser.parse_args()
     if flags.days < 0:
         parser.error('argument --days must be nonnegative')
     if flags.timeout < 0:
         parser.error('argument --timeout must be nonnegative')
+    if flags.prefetch < 0:
+        parser.error('argument --prefetch must be nonnegative')
+    if flags.seek < 0:
+        parser.error('argument --seek must be nonnegative')
+    if flags.spill is not None and flags.spill < 1:
+        parser.error('argument --spill must be positive')
+    if flags.backend == 'async' and aiohttp is None:
+        parser.error('argument --backend: async requires package aiohttp')
+    if flags.workers < 1:
+        parser.error('argument --workers must be positive')
+    if flags.batch and flags.workers > 1:
+        parser.error('argument --workers not allowed with argument --batch')
+    if flags.stream and (flags.view or not flags.auto):
+        parser.error('argument --stream requires argument --auto and not --view')
+    if flags.stream and flags.index:
+        parser.error('argument --index not allowed with argument --stream')
+    if flags.stream and flags.journal:
+        parser.error('argument --journal not allowed with argument --stream')
+    if flags.seek and flags.index:
+        parser.error('argument --seek not allowed with argument --index')
+    if flags.prefilter and flags.index:
+        parser.error('argument --prefilter not allowed with argument --index')
+    if flags.watch is not None and flags.watch < 1:
+        parser.error('argument --watch must be positive')
+    if flags.watch and (flags.view or not flags.auto):
+        parser.error('argument --watch requires argument --auto and not --view')
+    if flags.watch and flags.accounts:
+        parser.error('argument --watch not allowed with argument --accounts')
+    if flags.format != 'text' and not (flags.auto or flags.view):
+        parser.error('argument --format {} requires argument --auto or --view'.format(flags.format))
+    if flags.format != 'text' and flags.accounts:
+        parser.error('argument --format {} not allowed with argument --accounts'.format(flags.format))
     if flags.logfile and flags.logfile.strip():
         flags.logfile = os.path.realpath(flags.logfile)
         os.makedirs(os.path.dirname(flags.logfile),    exist_ok=True)
+    for option in ('statsjson', 'profile'):
+        path = getattr(flags, option)
+        if path:
+            setattr(flags, option, os.path.realpath(path))
+            os.makedirs(os.path.dirname(getattr(flags, option)), exist_ok=True)
     if flags.quiet and not flags.logfile:
         flags.fullpath = False
+    if not flags.fullpath:
+        flags.foldertree = False
+        flags.pathcache = False
     flags.ptokenfile = os.path.realpath(flags.ptokenfile)
     flags.credfile   = os.path.realpath(flags.credfile)
+    flags.discoveryfile = os.path.realpath(flags.discoveryfile)
     os.makedirs(os.path.dirname(flags.ptokenfile), exist_ok=True)
     os.makedirs(os.path.dirname(flags.credfile),   exist_ok=True)
+    os.makedirs(os.path.dirname(flags.discoveryfile), exist_ok=True)
+    if flags.accounts:
+        if not (flags.auto or flags.view):
+            parser.error('argument --accounts requires argument --auto or --view')
+        if flags.maxaccounts < 1:
+            parser.error('argument --maxaccounts must be positive')
+        try:
+            flags.accounts = read_accounts(flags.accounts, flags)
+        except (OSError, configparser.Error, ValueError) as e:
+            parser.error('argument --accounts: {}'.format(e))
     return flags
 
+def read_accounts(path, flags):
+    """Read the account list file specified by --accounts
+    
+    Return a list of (name, flags) for each account, where flags is a copy 
+    of `flags` with the account's 'credfile', 'ptokenfile' and 'days'.
+    """
+    config = configparser.ConfigParser()
+    with open(path, 'r', encoding='utf-8') as f:
+        config.read_file(f)
+    if not config.sections():
+        raise ValueError('no accounts in ' + path)
+    accounts = []
+    for name in config.sections():
+        section = config[name]
+        accountFlags = copy.copy(flags)
+        accountFlags.accounts = None
+        # output of accounts is printed together, so skip per file info
+        accountFlags.quiet = True
+        accountFlags.noprogress = True
+        if not flags.logfile:
+            accountFlags.fullpath = accountFlags.foldertree = accountFlags.pathcache = False
+        try:
+            accountFlags.credfile = os.path.realpath(os.path.expanduser(section['credfile']))
+            accountFlags.ptokenfile = os.path.realpath(os.path.expanduser(section['ptokenfile']))
+        except KeyError as e:
+            raise ValueError('account [{}] has no {}'.format(name, e))
+        accountFlags.days = section.getint('days', flags.days)
+        if accountFlags.days < 0:
+            raise ValueError('account [{}] has negative days'.format(name))
+        os.makedirs(os.path.dirname(accountFlags.ptokenfile), exist_ok=True)
+        os.makedirs(os.path.dirname(accountFlags.credfile),   exist_ok=True)
+        accounts.append((name, accountFlags))
+    return accounts
+
 def configure_logs(logPath):
     logger = logging.getLogger('gdtc')
     logger.setLevel(logging.INFO)
@@ -211,12 +774,70 @@ def configure_logs(logPath):
     logger.addHandler(fileHandler)
     return logger
 
-def build_service(flags):
-    credentials = get_credentials(flags)
-    http = credentials.authorize(httplib2.Http())
-    service = discovery.build('drive', 'v3', http=http)
+def build_service(http, discoveryFile=None):
+    """Build Google Drive API service object
+    
+    http:           Authorized Http object for the service to use.
+    discoveryFile:  Path to cache the API discovery document at, if the 
+                    client library doesn't ship one. A cached document is 
+                    used if it's newer than DISCOVERY_TTL seconds. Otherwise 
+                    it's fetched with http and cached.
+    """
+    document = get_discovery_document(http, discoveryFile)
+    service = discovery.build_from_document(document, http=http)
     return service
 
+_discoveryDocuments = {}
+
+def get_discovery_document(http, path=None):
+    """Get Google Drive API discovery document, cached in memory and at path
+    
+    The document shipped with the client library is used if available, 
+    without any network request or cache file.
+    """
+    if path in _discoveryDocuments:
+        return _discoveryDocuments[path]
+    document = get_static_doc('drive', 'v3') if get_static_doc else None
+    if document is not None:
+        _discoveryDocuments[path] = document
+        return document
+    if path:
+        try:
+            if time.time() - os.path.getmtime(path) < DISCOVERY_TTL:
+                with open(path, 'r', encoding='utf-8') as f:
+                    document = f.read()
+                json.loads(document)
+        except (OSError, ValueError):
+            document = None
+    if document is None:
+        resp, content = http.request(DISCOVERY_URL)
+        if resp.status >= 400:
+            raise HttpError(resp, content, uri=DISCOVERY_URL)
+        document = content.decode('utf-8')
+        if path:
+            save_discovery_document(document, path)
+    _discoveryDocuments[path] = document
+    return document
+
+def save_discovery_document(document, path):
+    """Cache discovery document at path, if possible
+    
+    The document is written to a temporary file first, as other processes 
+    may be reading path. Failures are reported and otherwise ignored, as 
+    the document is still usable in memory.
+    """
+    tempPath = None
+    try:
+        fd, tempPath = tempfile.mkstemp(dir=os.path.dirname(path))
+        with open(fd, 'w', encoding='utf-8') as f:
+            f.write(document)
+        os.replace(tempPath, path)
+    except OSError as e:
+        print('Cannot save discovery document:', e)
+        if tempPath:
+            with contextlib.suppress(OSError):
+                os.remove(tempPath)
+
 def get_credentials(flags):
     """Gets valid user credentials from storage.
 
@@ -236,7 +857,8 @@ def get_credentials(flags):
         print('credential file saved at\n\t' + flags.credfile)
     return credentials
 
-def get_deletion_list(service, pageToken, flags, pathFinder=None):
+def get_deletion_list(service, pageToken, flags, pathFinder=None, credentials=None,
+                      summary=None):
     """Get list of files to be deleted and page token for future use.
     
     deletionList, pageTokenBefore, pageTokenAfter
@@ -251,9 +873,8 @@ def get_deletion_list(service, pageToken, flags, pathFinder=None):
                     Only changes made after this point will be checked. By 
                     assumption, trashed files before this point are all 
                     deleted.
-    deletionList:   List of trashed files to be deleted, in ascending order of 
-                    trash time. Each file is represented as a dictionary with 
-                    keys {'fileId', 'time', 'name'}.
+    deletionList:   DeletionList of trashed files to be deleted, in ascending 
+                    order of trash time.
     flags:          Flags parsed from command line. Should contain the 
                     following attributes:
                     --noprogress    don't show scanning progress
@@ -262,6 +883,13 @@ def get_deletion_list(service, pageToken, flags, pathFinder=None):
                     --quiet         don't show individual file info
                     --timeout       timeout in seconds
                     --days          maximum days in trash
+                    --prefetch      number of pages to fetch ahead
+                    --seek          number of ranges to fetch concurrently
+                    --prefilter     list trashed files before scanning
+                    --spill         number of files to keep in memory
+    credentials:    Credentials to authorize the Http object of the 
+                    prefetching thread with.
+    summary:        CleanSummary to count scanned changes and found files in.
     pageTokenBefore:
                     An integer representing a point in Drive change list, 
                     >= 'pageToken'.
@@ -272,60 +900,388 @@ def get_deletion_list(service, pageToken, flags, pathFinder=None):
                     Can be used as future pageToken only if everything in 
                     deletionList is deleted.
     """
-    response = execute_request(service.changes().getStartPageToken(), flags.timeout)
-    latestPageToken = int(response.get('startPageToken'))
-    currentTime = time.time()
-    deletionList = []
     if not pageToken:
         pageToken = 1
-    pageTokenBefore = pageToken
-    pageSize = PAGE_SIZE_LARGE
+    deletionList = DeletionList(flags.spill)
+    pageTokenBefore = pageTokenAfter = pageToken
+    with stats.phase('scan'):
+        for found, resumeToken in iter_deletion_pages(service, pageToken, flags, pathFinder,
+                                                         credentials, summary):
+            deletionList.extend(found)
+            if not deletionList:
+                pageTokenBefore = resumeToken
+            pageTokenAfter = resumeToken
+    return deletionList, pageTokenBefore, pageTokenAfter
+
+def create_path_finder(service, flags):
+    """Create PathFinder for --fullpath, loading the path cache file (--pathcache) 
+    and all folders (--foldertree) if specified"""
+    pathFinder = PathFinder(service)
+    if flags.pathcache:
+        pathFinder.load(flags.ptokenfile + PATH_CACHE_SUFFIX)
+    if flags.foldertree:
+        pathFinder.load_folder_tree(flags.timeout)
+    return pathFinder
+
+@stats.phase('scan')
+def get_indexed_deletion_list(service, scanIndex, pageToken, flags, pathFinder=None,
+                              credentials=None, summary=None):
+    """Get list of files to be deleted from a ScanIndex, after updating it
+    
+    deletionList, pageTokenBefore, pageTokenAfter
+        = get_indexed_deletion_list(service, scanIndex, pageToken, flags)
+    
+    Drive change list is scanned from the end of scanIndex to the latest 
+    change. If scanIndex is empty, scan from pageToken instead.
+    Return values and other arguments are the same as get_deletion_list().
+    """
+    cutoffTime = time.time() - flags.days*24*3600
+    indexToken = scanIndex.get_token() or pageToken or 1
     progress = ScanProgress(quiet=flags.quiet, noProgress=flags.noprogress)
     if not pathFinder and flags.fullpath:
-        pathFinder = PathFinder(service)
-    while pageToken:
+        pathFinder = create_path_finder(service, flags)
+    pages = change_pages(service, indexToken, None, flags, credentials, includeRemoved=True)
+    for indexToken, response in pages:
+        items = response.get('changes', [])
+        if flags.fullpath:
+            pathFinder.apply_changes(items)
+        for item in items:
+            progress.print_time(item['time'])
+        if summary:
+            summary.scanned += len(items)
+        scanIndex.update(items, int(indexToken),
+                         int(response.get('nextPageToken') or response.get('newStartPageToken')))
+    progress.clear_line()
+    if flags.fullpath:
+        pathFinder.prefetch({'parents': [parentId]}
+                            for parentId in scanIndex.iter_parents(cutoffTime))
+    listing = ScanProgress(quiet=flags.quiet, noProgress=True, listingFormat=flags.format)
+    deletionList = DeletionList(flags.spill)
+    for fileId, timeStr, name, parentId in scanIndex.iter_trashed(cutoffTime):
+        if flags.fullpath:
+            fileRes = {'name': name, 'parents': [parentId]} if parentId else {'name': name}
+            name = pathFinder.get_path(fileId, fileRes=fileRes)
+        listing.found(timeStr, name, fileId)
+        deletionList.append(TrashedFile(fileId, timeStr, name))
+    listing.flush()
+    if summary:
+        summary.found += len(deletionList)
+    return deletionList, scanIndex.token_before(), scanIndex.token_before(cutoffTime)
+
+def iter_deletion_pages(service, pageToken, flags, pathFinder=None, credentials=None,
+                        summary=None):
+    """Scan Drive change list page by page for files to be deleted
+    
+    Generator. For each page of the change list, yield (found, resumeToken).
+    With --prefilter, only files listed in trash beforehand are looked for, 
+    and the scan stops once all of them are found.
+    
+    found:          List of trashed files to be deleted in this page, in 
+                    ascending order of trash time. Same format as 
+                    deletionList of get_deletion_list().
+    resumeToken:    An integer representing a point in Drive change list. 
+                    Can be used as future pageToken once everything found 
+                    in this page and all previous pages is deleted.
+    Other arguments are the same as get_deletion_list().
+    """
+    cutoff = TimeCutoff(time.time() - flags.days*24*3600)
+    if not pageToken:
+        pageToken = 1
+    candidates = None
+    if flags.prefilter:
+        # files trashed after this point are found in the change list anyway
+        request = service.changes().getStartPageToken()
+        latestPageToken = int(execute_request(request, flags.timeout).get('startPageToken'))
+        candidates = list_trashed_files(service, flags.timeout)
+        undated = set(candidates)
+        if not undated:
+            yield [], latestPageToken
+            return
+    # without file resources, renamed and moved folders can't be updated
+    minimal = flags.prefilter and not flags.pathcache
+    progress = ScanProgress(quiet=flags.quiet, noProgress=flags.noprogress,
+                            listingFormat=flags.format)
+    if not pathFinder and flags.fullpath:
+        pathFinder = create_path_finder(service, flags)
+    pages = change_pages(service, pageToken, cutoff.unixTime, flags, credentials,
+                         minimal=minimal)
+    for pageToken, response in pages:
+        items = response.get('changes', [])
+        # changes made before cutoff, which are all at the start of the page
+        scanned = items[:cutoff.split(items)]
+        trashed = []
+        for item in scanned:
+            if candidates is None:
+                file = item['file']
+                if file['explicitlyTrashed'] and file['ownedByMe']:
+                    trashed.append((item, file))
+            elif item['fileId'] in undated:
+                undated.discard(item['fileId'])
+                trashed.append((item, candidates[item['fileId']]))
+        if flags.fullpath:
+            if not minimal:
+                pathFinder.apply_changes(items)
+            pathFinder.prefetch(file for _, file in trashed)
+        found = []
+        for item, file in trashed:
+            progress.print_time(item['time'])
+            if flags.fullpath:
+                disp = pathFinder.get_path(item['fileId'], fileRes=file)
+            else:
+                disp = file['name']
+            progress.found(item['time'], disp, item['fileId'])
+            found.append(TrashedFile(item['fileId'], item['time'], disp))
+        if scanned:
+            progress.print_time(scanned[-1]['time'])
+        if summary:
+            summary.scanned += response.get('scannedCount', len(scanned))
+            summary.found += len(found)
+        if len(scanned) < len(items):
+            progress.clear_line()
+            pages.close()
+            yield found, int(pageToken)
+            return
+        nextPageToken = response.get('nextPageToken')
+        if candidates is not None and (not undated or
+                int(nextPageToken or response.get('newStartPageToken')) >= latestPageToken):
+            # all files in trash are found, or the rest were changed after 
+            # being listed, which are left to the next run
+            progress.clear_line()
+            pages.close()
+            yield found, latestPageToken
+            return
+        if nextPageToken:
+            yield found, int(nextPageToken)
+    progress.clear_line()
+    yield found, int(response.get('newStartPageToken'))
+
+def list_trashed_files(service, timeout=TIMEOUT_DEFAULT):
+    """List files explicitly trashed and owned by the user
+    
+    Return a dictionary of file ID: file resource with 'name' and 'parents'.
+    """
+    files = {}
+    npt = None
+    while True:
+        request = service.files().list(
+                q="trashed=true and 'me' in owners",
+                pageToken=npt,
+                fields="files(id,name,parents,explicitlyTrashed),nextPageToken",
+                pageSize=1000)
+        response = execute_request(request, timeout)
+        for file in response.get('files', []):
+            if file.get('explicitlyTrashed'):
+                files[file.pop('id')] = file
+        try:
+            npt = response['nextPageToken']
+        except KeyError:
+            return files
+
+def change_pages(service, pageToken, cutoffTime, flags, credentials=None, includeRemoved=False,
+                 minimal=False):
+    """Return iter_change_pages(), run in a separate thread if --prefetch is set, 
+    or seek_change_pages() if --seek is set and cutoffTime is given
+    
+    credentials:    Credentials to authorize the Http object of the 
+                    prefetching thread with. Without them, pages are fetched 
+                    in the calling thread with service's Http.
+    """
+    threaded = can_use_threads(service, credentials)
+    if flags.seek and threaded and cutoffTime is not None and not includeRemoved:
+        return seek_change_pages(service, pageToken, cutoffTime, flags, credentials, minimal)
+    if not flags.prefetch or not threaded:
+        return iter_change_pages(service, pageToken, cutoffTime, flags,
+                                 includeRemoved=includeRemoved, minimal=minimal)
+    http = ThreadHttp(credentials).http
+    return iter_in_thread(iter_change_pages(service, pageToken, cutoffTime, flags, http,
+                                            includeRemoved, minimal=minimal),
+                          flags.prefetch)
+
+def iter_change_pages(service, pageToken, cutoffTime, flags, http=None, includeRemoved=False,
+                      endToken=None, latestPageToken=None, minimal=False):
+    """Fetch Drive change list page by page, starting from pageToken
+    
+    Generator. Yield (pageToken, response) for each page. Stop after the 
+    first page containing a change made after cutoffTime (Unix time), so no 
+    quota is spent on pages that won't be used. If cutoffTime is None, fetch 
+    till the end of the change list.
+    http:           Http object to execute requests with instead of 
+                    service's own.
+    includeRemoved: Include changes of files removed from the user's Drive. 
+                    Such changes have no 'file' and 'removed' is True.
+    endToken:       Stop before page token endToken. Pages are no larger 
+                    than the tokens left, but the last page may still run 
+                    past endToken where page tokens are sparse.
+    latestPageToken:
+                    Result of changes().getStartPageToken(), if already known.
+    minimal:        Only fetch 'fileId' and 'time' of changes.
+    """
+    cutoff = TimeCutoff(cutoffTime) if cutoffTime is not None else None
+    if latestPageToken is None:
+        request = service.changes().getStartPageToken()
+        latestPageToken = int(execute_request(request, flags.timeout, http).get('startPageToken'))
+    pageSize = PAGE_SIZE_LARGE
+    while pageToken and (endToken is None or int(pageToken) < endToken):
         if latestPageToken - int(pageToken) < PAGE_SIZE_SWITCH_THRESHOLD:
             pageSize = PAGE_SIZE_SMALL
+        if endToken is not None:
+            pageSize = min(pageSize, endToken - int(pageToken))
         request = service.changes().list(
-                    pageToken=pageToken, includeRemoved=False,
+                    pageToken=pageToken, includeRemoved=includeRemoved,
                     pageSize=pageSize, restrictToMyDrive=flags.mydriveonly,
-                    fields='nextPageToken,newStartPageToken,'
-                    'changes(fileId,time,file(name,parents,explicitlyTrashed,ownedByMe))'
+                    fields='nextPageToken,newStartPageToken,' + (
+                        'changes(fileId,time)' if minimal else
+                        'changes(fileId,removed,time,file(name,parents,explicitlyTrashed,ownedByMe))')
                     )
-        response = execute_request(request, flags.timeout)
+        response = execute_request(request, flags.timeout, http)
+        yield pageToken, response
         items = response.get('changes', [])
-        for item in items:
-            itemTime = parse_time(item['time'])
-            if currentTime - itemTime < flags.days*24*3600:
-                progress.clear_line()
-                return deletionList, pageTokenBefore, pageToken
-            progress.print_time(item['time'])
-            if item['file']['explicitlyTrashed'] and item['file']['ownedByMe']:
-                if flags.fullpath:
-                    disp = pathFinder.get_path(item['fileId'], fileRes=item['file'])
-                else:
-                    disp = item['file']['name']
-                progress.found(item['time'], disp)
-                deletionList.append({'fileId': item['fileId'], 'time': item['time'],
-                                        'name': disp})
+        if cutoff and items and cutoff.after(items[-1]['time']):
+            return
         pageToken = response.get('nextPageToken')
-        if not deletionList:
-            pageTokenBefore = pageToken
-    progress.clear_line()
-    return deletionList, pageTokenBefore, int(response.get('newStartPageToken'))
 
-def delete_old_files(service, deletionList, flags):
+def seek_change_pages(service, pageToken, cutoffTime, flags, credentials=None, minimal=False):
+    """Fetch Drive change list up to cutoffTime in flags.seek ranges at a time
+    
+    Generator. Yield the same pages as iter_change_pages(), in the same 
+    order. The first change made after cutoffTime is located by binary 
+    search, and the change list from pageToken up to it is split into 
+    flags.seek ranges of page tokens, each fetched in a separate thread. 
+    The last range runs on till cutoffTime.
+    As ranges are fetched ahead of the caller, their pages only keep changes 
+    of trashed files owned by the user and the first change made after 
+    cutoffTime, with 'scannedCount' giving the number of changes made before 
+    cutoffTime. With --pathcache, pages are kept whole for 
+    PathFinder.apply_changes(). With minimal, pages are kept whole too, as 
+    they are small.
+    credentials:    Credentials to authorize the Http objects of the 
+                    fetching threads with.
+    """
+    cutoff = TimeCutoff(cutoffTime)
+    pageToken = int(pageToken)
+    request = service.changes().getStartPageToken()
+    latestPageToken = int(execute_request(request, flags.timeout).get('startPageToken'))
+    with stats.phase('seek'):
+        endToken = find_change_token(service, pageToken, latestPageToken, cutoff, flags.timeout)
+    numRanges = max(1, min(flags.seek, (endToken - pageToken) // PAGE_SIZE_LARGE))
+    starts = [pageToken + (endToken - pageToken)*i//numRanges for i in range(numRanges)]
+    http = ThreadHttp(credentials)
+    stop = threading.Event()
+    def trim(response):
+        items = response.get('changes', [])
+        n = cutoff.split(items)
+        kept = [item for item in items[:n]
+                    if item['file']['explicitlyTrashed'] and item['file']['ownedByMe']]
+        return dict(response, changes=kept + items[n:n+1], scannedCount=n)
+    def fetch(start, end):
+        for page, response in iter_change_pages(service, start, cutoffTime, flags, http.http,
+                                                endToken=end, latestPageToken=latestPageToken,
+                                                minimal=minimal):
+            if stop.is_set():
+                return
+            yield page, response if flags.pathcache or minimal else trim(response)
+    ranges = [iter_in_thread(fetch(start, end), 0)
+                for start, end in zip(starts, starts[1:] + [None])]
+    try:
+        lastIds = set()
+        for pages in ranges:
+            items = []
+            for page, response in pages:
+                items = response.get('changes', [])
+                if lastIds:
+                    # drop changes also fetched by the previous range
+                    items = response['changes'] = [item for item in items
+                                                      if item['fileId'] not in lastIds]
+                yield page, response
+            lastIds = set(item['fileId'] for item in items)
+    finally:
+        stop.set()
+        for pages in ranges:
+            pages.close()
+
+def find_change_token(service, lo, hi, cutoff, timeout=TIMEOUT_DEFAULT, http=None):
+    """Find the page token of the first change made after cutoff
+    
+    Binary search between page tokens lo and hi, probing a small page of 
+    the change list at each step till the two are less than a large page 
+    apart. Return hi. Changes before lo are assumed to be made before cutoff.
+    cutoff:     TimeCutoff
+    http:       Http object to execute requests with instead of service's 
+                own.
+    """
+    while hi - lo > PAGE_SIZE_LARGE:
+        mid = (lo + hi) // 2
+        # a small page rather than a single change, so a probe is rarely 
+        # empty where most changes have been superseded
+        request = service.changes().list(pageToken=mid, pageSize=PAGE_SIZE_SMALL,
+                                          includeRemoved=True, fields='changes(time)')
+        items = execute_request(request, timeout, http).get('changes', [])
+        if items and not cutoff.after(items[0]['time']):
+            lo = mid
+        else:
+            hi = mid
+    return hi
+
+def iter_in_thread(iterable, size):
+    """Iterate through `iterable` in a separate thread, up to `size` items ahead
+    
+    Return a generator yielding the same items as `iterable`. The thread 
+    starts right away. If size is 0, it never waits for the caller. 
+    Exceptions raised in the thread are re-raised in the caller's. The 
+    thread stops soon after the generator is closed, if it has been started.
+    """
+    items = queue.Queue(size)
+    stop = threading.Event()
+    def put(entry):
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=1)
+                return
+            except queue.Full:
+                pass
+    def run():
+        try:
+            for item in iterable:
+                put((True, item))
+                if stop.is_set():
+                    return
+        except BaseException as e:
+            put((False, e))
+        else:
+            put((False, None))
+    threading.Thread(target=safePrinter.inherit(run), daemon=True).start()
+    def iterate():
+        try:
+            while True:
+                isItem, item = items.get()
+                if isItem:
+                    yield item
+                elif item is None:
+                    return
+                else:
+                    raise item
+        finally:
+            stop.set()
+    return iterate()
+
+def delete_old_files(service, deletionList, flags, credentials=None, summary=None,
+                     journal=None, resumeToken=None):
     """Print and delete files in deletionList
     
-    listEmpty = delete_old_files(service, deletionList, flags)
+    listEmpty = delete_old_files(service, deletionList, flags, credentials, summary)
     
     service:        Google API service object
-    deletionList:   List of trashed files to be deleted, in ascending order of 
-                    trash time. Each file is represented as a dictionary with 
-                    keys {'fileId', 'time', 'name'}.
+    deletionList:   DeletionList, or list of TrashedFile, to be deleted, in 
+                    ascending order of trash time.
     flags:          Flags parsed from command line arguments. In 
                     particular, automatic deletion (no user prompt) and view-
                     only mode (print but don't delete) are supported.
+    credentials:    Credentials to authorize worker threads' Http objects 
+                    with when deleting with --workers.
+    summary:        CleanSummary to count deleted files in.
+    journal:        DeletionJournal to record files in before and after 
+                    they're deleted, with resumeToken, the page token to 
+                    save once all of them are deleted.
     listEmpty:      Return True if deletionList is either empty on input or 
                     emptied by this function, False otherwise.
     """
@@ -345,59 +1301,516 @@ def delete_old_files(service, deletionList, flags):
         if not confirmed:
             return False
     print('Deleting...')
-    for item in reversed(deletionList):
-        request = service.files().delete(fileId = item['fileId'])
-        execute_request(request, flags.timeout)
-        logger.info(item['time'] + ''.ljust(4) + item['name'])
+    if journal:
+        journal.plan(deletionList, resumeToken)
+    with stats.phase('delete'):
+        for item in delete_files(service, reversed(deletionList), flags, credentials):
+            if journal:
+                journal.done(item.fileId)
+            logger.info(item.time + ''.ljust(4) + item.name)
+            if summary:
+                summary.deleted += 1
     print('Files successfully deleted')
     return True
 
+def resume_deletion(service, journal, pageTokenFile, flags, credentials=None, summary=None,
+                    scanIndex=None):
+    """Finish deleting files recorded in journal by an interrupted run
+    
+    Files not deleted yet are deleted without asking, as the deletion was 
+    confirmed when it started, unless they're no longer in trash, e.g. 
+    restored since. Then the page token recorded in journal is saved to 
+    pageTokenFile, and journal is removed.
+    scanIndex:  ScanIndex to remove deleted files from.
+    """
+    logger = logging.getLogger('gdtc')
+    pageToken, planned = journal.load(flags.spill)
+    if pageToken is None:
+        return
+    deletionList = None
+    try:
+        deletionList = filter_trashed(service, planned, flags)
+        skipped = len(planned) - len(deletionList)
+        if skipped:
+            print('Skipping {} files/folders no longer in trash'.format(skipped))
+        print('Resuming deletion of {} files/folders'.format(len(deletionList)))
+        if summary:
+            summary.found += len(deletionList)
+        with stats.phase('delete'):
+            for item in delete_files(service, reversed(deletionList), flags, credentials):
+                journal.done(item.fileId)
+                logger.info(item.time + ''.ljust(4) + item.name)
+                if summary:
+                    summary.deleted += 1
+        pageTokenFile.save(pageToken)
+        if scanIndex:
+            scanIndex.remove(item.fileId for item in deletionList)
+        journal.finish()
+    finally:
+        planned.close()
+        if deletionList is not None:
+            deletionList.close()
+
+def filter_trashed(service, items, flags):
+    """Check which files are still explicitly trashed
+    
+    Files are queried in batches of BATCH_SIZE. Return a DeletionList of 
+    items still explicitly trashed, or not found (404), which are taken as 
+    deleted. Any other error is raised, so no file is skipped for good 
+    without being checked.
+    """
+    deletionList = DeletionList(flags.spill)
+    files = service.files()
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, BATCH_SIZE))
+        if not chunk:
+            return deletionList
+        requests = [files.get(fileId=item.fileId, fields='trashed,explicitlyTrashed')
+                        for item in chunk]
+        for item, response in zip(chunk, execute_batch(service, requests, flags.timeout)):
+            if isinstance(response, HttpError) and is_not_found_error(response):
+                deletionList.append(item)
+            elif isinstance(response, Exception):
+                deletionList.close()
+                raise response
+            elif response.get('explicitlyTrashed'):
+                deletionList.append(item)
+
+def delete_files(service, items, flags, credentials=None, http=None):
+    """Delete files in the way specified by flags (--batch, --workers)
+    
+    Generator. Yield each item in `items` after it's deleted, in input order. 
+    Files not found (404) are taken as deleted, e.g. by an interrupted run.
+    items:  Iterable of TrashedFile. Consumed as deletion goes.
+    http:   Http object to execute requests with instead of service's own.
+            Not used by --workers, whose threads have their own.
+    Without credentials to authorize worker threads with, --workers 
+    deletes files one by one.
+    """
+    if flags.batch:
+        return batch_delete(service, items, flags.timeout, http)
+    elif flags.workers > 1 and can_use_threads(service, credentials):
+        return parallel_delete(service, items, flags.workers, flags.timeout, credentials)
+    else:
+        return sequential_delete(service, items, flags.timeout, http)
+
+@stats.phase('stream')
+def stream_delete(service, pageTokenFile, flags, pathFinder=None, credentials=None,
+                  summary=None):
+    """Delete files while scanning for them
+    
+    n = stream_delete(service, pageTokenFile, flags, pathFinder, credentials, summary)
+    
+    Drive change list is scanned in a separate thread with service's Http. 
+    Files found in each page are deleted with another Http as soon as the 
+    page is scanned, newest first. The page token file is updated after 
+    each page, once that page and all pages before it are deleted. Without 
+    credentials to authorize another Http with, pages are scanned and 
+    deleted in turn in the calling thread.
+    summary:    CleanSummary to count scanned changes, found and deleted 
+                files in.
+    n:          Number of files deleted.
+    """
+    logger = logging.getLogger('gdtc')
+    pages = iter_deletion_pages(service, pageTokenFile.get(), flags, pathFinder, credentials,
+                                summary)
+    http = None
+    if can_use_threads(service, credentials):
+        pages = iter_in_thread(pages, STREAM_QUEUE_SIZE)
+        http = ThreadHttp(credentials).http
+    n = 0
+    try:
+        for found, resumeToken in pages:
+            with stats.phase('delete'):
+                for item in delete_files(service, list(reversed(found)), flags, credentials, http):
+                    logger.info(item.time + ''.ljust(4) + item.name)
+                    n += 1
+                    if summary:
+                        summary.deleted += 1
+            pageTokenFile.save(resumeToken)
+    finally:
+        pages.close()
+    if n == 0:
+        print('No files to be deleted')
+    elif n == 1:
+        print('1 file/folder deleted')
+    else:
+        print('{:} files/folders deleted'.format(n))
+    return n
+
+class TrashedFile:
+    """A trashed file to be deleted
+    
+    time:   Time it was trashed, in RFC 3339 format.
+    name:   Its name, or full path with --fullpath. The path is kept as the 
+            parent folder's path and a base name, so folder paths can be 
+            shared between files.
+    """
+    __slots__ = ('fileId', 'time', 'folder', 'baseName')
+    
+    def __init__(self, fileId, time, name):
+        self.fileId = fileId
+        self.time = time
+        self.folder = None
+        self.baseName = name
+    
+    @property
+    def name(self):
+        if self.folder is None:
+            return self.baseName
+        return self.folder + os.sep + self.baseName
+
+class DeletionList:
+    """List of TrashedFile to be deleted, in ascending order of trash time
+    
+    Only appending, len() and iteration (also reversed()) are supported. 
+    Files with full paths in the same folder share one copy of its path.
+    spillSize:  If not None, once spillSize files are kept in memory, they're 
+                moved to a temporary SQLite database on disk, so memory use 
+                is bounded for any number of files.
+    """
+    def __init__(self, spillSize=None):
+        self.spillSize = spillSize
+        self.items = []
+        self.folders = {}
+        self.conn = None
+        self.spilled = 0
+    
+    def append(self, item):
+        folder, sep, baseName = item.name.rpartition(os.sep)
+        if sep:
+            item.folder = self.folders.setdefault(folder, folder)
+            item.baseName = baseName
+        self.items.append(item)
+        if self.spillSize and len(self.items) >= self.spillSize:
+            self._spill()
+    
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+    
+    def __len__(self):
+        return self.spilled + len(self.items)
+    
+    def __iter__(self):
+        if self.conn:
+            for row in self.conn.execute('SELECT fileId, time, name FROM files ORDER BY rowid'):
+                yield TrashedFile(*row)
+        yield from self.items
+    
+    def __reversed__(self):
+        yield from reversed(self.items)
+        if self.conn:
+            for row in self.conn.execute('SELECT fileId, time, name FROM files '
+                                         'ORDER BY rowid DESC'):
+                yield TrashedFile(*row)
+    
+    def _spill(self):
+        if not self.conn:
+            # an empty file name makes a temporary database, deleted on close
+            self.conn = sqlite3.connect('')
+            self.conn.execute('CREATE TABLE files (fileId TEXT, time TEXT, name TEXT)')
+        with self.conn:
+            self.conn.executemany('INSERT INTO files VALUES (?, ?, ?)',
+                                  ((item.fileId, item.time, item.name) for item in self.items))
+        self.spilled += len(self.items)
+        self.items = []
+        self.folders.clear()
+    
+    def close(self):
+        """Delete the temporary database, if any"""
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+            self.spilled = 0
+
+class DeletionJournal:
+    """Append-only journal of files to be deleted and files deleted
+    
+    Each line is a JSON array: ["plan", fileId, time, name] for each file to 
+    be deleted, then ["token", pageToken] with the page token to save once 
+    all of them are deleted, then ["done", fileId] for each file deleted. 
+    "done" lines are synced to disk every JOURNAL_SYNC_SIZE files, so a few 
+    files may be deleted again when resuming, which is harmless.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.unsynced = 0
+    
+    def load(self, spillSize=None):
+        """Read the journal of an interrupted deletion
+        
+        pageToken, deletionList = journal.load(spillSize)
+        
+        deletionList:   DeletionList of files planned but not deleted yet, 
+                        in the order planned.
+        pageToken:      Page token recorded, or None if there's no complete 
+                        journal. Deletion starts after the plan is synced, 
+                        so an incomplete one is ignored.
+        Afterwards, "done" lines are appended to the same journal.
+        """
+        pageToken = None
+        done = set()
+        deletionList = DeletionList(spillSize)
+        try:
+            for entry in self._read():
+                if entry[0] == 'token':
+                    pageToken = entry[1]
+                elif entry[0] == 'done':
+                    done.add(entry[1])
+            if pageToken is not None:
+                for entry in self._read():
+                    if entry[0] == 'plan' and entry[1] not in done:
+                        deletionList.append(TrashedFile(*entry[1:]))
+        except FileNotFoundError:
+            pass
+        if pageToken is not None:
+            self.file = open(self.path, 'a', encoding='utf-8')
+        return pageToken, deletionList
+    
+    def _read(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # last line cut short by the interruption
+                    pass
+    
+    def plan(self, items, pageToken):
+        """Start a new journal with files to be deleted, and sync it"""
+        self.close()
+        self.file = open(self.path, 'w', encoding='utf-8')
+        for item in items:
+            self._write(['plan', item.fileId, item.time, item.name])
+        self._write(['token', pageToken])
+        self.sync()
+    
+    def done(self, fileId):
+        self._write(['done', fileId])
+        self.unsynced += 1
+        if self.unsynced >= JOURNAL_SYNC_SIZE:
+            self.sync()
+    
+    def _write(self, entry):
+        self.file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+    
+    def close(self):
+        """Sync and close the journal, keeping it for the next run"""
+        if self.file:
+            self.sync()
+            self.file.close()
+            self.file = None
+    
+    def finish(self):
+        """Close and remove the journal, once the page token is saved"""
+        if self.file:
+            self.file.close()
+            self.file = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+class ScanIndex:
+    """Local SQLite index of trashed files in Drive change list
+    
+    The index keeps the latest change of each file that is explicitly 
+    trashed and owned by the user, with the position (page token) of the 
+    page it was found in, as well as the page token to continue scanning 
+    from. Changes to other files remove them from the index.
+    """
+    def __init__(self, path, mydriveonly=False):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta '
+                              '(key TEXT PRIMARY KEY, value TEXT)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS changes '
+                              '(fileId TEXT PRIMARY KEY, time TEXT, unixTime INTEGER, '
+                              'name TEXT, parentId TEXT, pageToken INTEGER)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS changes_unixTime '
+                              'ON changes (unixTime)')
+        # an index built with a different --mydriveonly has different contents
+        if self._get_meta('mydriveonly') != str(bool(mydriveonly)):
+            with self.conn:
+                self.conn.execute('DELETE FROM changes')
+                self.conn.execute('DELETE FROM meta')
+                self._set_meta('mydriveonly', str(bool(mydriveonly)))
+    
+    def _get_meta(self, key):
+        row = self.conn.execute('SELECT value FROM meta WHERE key=?', (key,)).fetchone()
+        return row[0] if row else None
+    
+    def _set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, str(value)))
+    
+    def get_token(self):
+        """Page token to continue scanning from. 0 if index is empty"""
+        return int(self._get_meta('pageToken') or 0)
+    
+    def update(self, items, pageToken, nextPageToken):
+        """Record changes in a page of Drive change list
+        
+        items:          'changes' in the response of changes().list()
+        pageToken:      Page token of this page.
+        nextPageToken:  Page token to continue scanning from.
+        """
+        rows = []
+        removed = []
+        for item in items:
+            file = item.get('file')
+            if item.get('removed') or not file or not file.get('explicitlyTrashed') \
+                    or not file.get('ownedByMe'):
+                removed.append((item['fileId'],))
+            else:
+                parentId = file['parents'][0] if file.get('parents') else None
+                rows.append((item['fileId'], item['time'], parse_time(item['time']),
+                             file['name'], parentId, pageToken))
+        with self.conn:
+            self.conn.executemany('DELETE FROM changes WHERE fileId=?', removed)
+            self.conn.executemany('INSERT OR REPLACE INTO changes VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._set_meta('pageToken', nextPageToken)
+    
+    def iter_trashed(self, cutoffTime):
+        """Iterate through (fileId, time, name, parentId) of files trashed 
+        before cutoffTime (Unix time), in ascending order of trash time"""
+        return self.conn.execute('SELECT fileId, time, name, parentId FROM changes '
+                                 'WHERE unixTime <= ? ORDER BY unixTime, time', (cutoffTime,))
+    
+    def iter_parents(self, cutoffTime):
+        """Iterate through distinct parent folder ids of files trashed before 
+        cutoffTime (Unix time)"""
+        return (row[0] for row in self.conn.execute(
+                    'SELECT DISTINCT parentId FROM changes '
+                    'WHERE unixTime <= ? AND parentId IS NOT NULL', (cutoffTime,)))
+    
+    def token_before(self, cutoffTime=None):
+        """Page token before all files trashed after cutoffTime (Unix time)
+        
+        If cutoffTime is None, before all files in the index. Can be used as 
+        pageToken of get_deletion_list() once files trashed before 
+        cutoffTime are deleted.
+        """
+        if cutoffTime is None:
+            cutoffTime = float('-inf')
+        row = self.conn.execute('SELECT MIN(pageToken) FROM changes WHERE unixTime > ?',
+                                (cutoffTime,)).fetchone()
+        return row[0] if row[0] is not None else self.get_token()
+    
+    def remove(self, fileIds):
+        """Remove deleted files from index"""
+        with self.conn:
+            self.conn.executemany('DELETE FROM changes WHERE fileId=?',
+                                  ((fileId,) for fileId in fileIds))
+
 class ScanProgress:
-    def __init__(self, quiet, noProgress):
+    """Progress line and listing of found files while scanning
+    
+    Output is buffered. The progress line is updated at most every 
+    PROGRESS_INTERVAL seconds, and found files are listed in blocks of 
+    OUTPUT_BLOCK_SIZE, or whatever is found in PROGRESS_INTERVAL seconds.
+    listingFormat:  'text' to list found files for people, together with the 
+                    progress line, or 'jsonl' or 'csv' to list them on 
+                    stdout for other programs.
+    """
+    def __init__(self, quiet, noProgress, listingFormat='text'):
         self.printed = "0000-00-00"
+        self.shown = self.printed
         self.noItemYet = True
         self.quiet = quiet
         self.noProgress = noProgress
+        self.format = listingFormat
+        self.buffer = io.StringIO()
+        self.buffered = 0
+        self.csvWriter = csv.writer(self.buffer, lineterminator='\n')
+        self.lastWrite = time.monotonic()
     
     def print_time(self, timeStr):
-        """print yyyy-mm-dd only if not yet printed"""
-        if self.noProgress:
-            return
+        """show yyyy-mm-dd only if not yet shown"""
         ymd = timeStr[:10]
         if ymd > self.printed:
-            print('\rScanning files trashed on ' + ymd, end='')
             self.printed = ymd
+        elif not self.buffered:
+            return
+        if time.monotonic() - self.lastWrite >= PROGRESS_INTERVAL:
+            self.flush()
     
-    def found(self, time, name):
-        """found an item, print its info"""
+    def found(self, timeStr, name, fileId=None):
+        """found an item, list its info"""
         if self.quiet:
             return
-        if not self.noProgress:
-            print('\r' + ''.ljust(40) + '\r', end='')
         if self.noItemYet:
-            print('Date trashed'.ljust(24) + ''.ljust(4) + 'File Name/Path')
+            if self.format == 'text':
+                self.buffer.write('Date trashed'.ljust(24) + ''.ljust(4) + 'File Name/Path\n')
+            elif self.format == 'csv':
+                self.csvWriter.writerow(['time', 'fileId', 'name'])
             self.noItemYet = False
-        print(time + ''.ljust(4) + name)
-        if not self.noProgress:
-            print('\rScanning files trashed on ' + self.printed, end='')
+        if self.format == 'jsonl':
+            self.buffer.write(json.dumps({'time': timeStr, 'fileId': fileId, 'name': name},
+                                         ensure_ascii=False) + '\n')
+        elif self.format == 'csv':
+            self.csvWriter.writerow([timeStr, fileId, name])
+        else:
+            self.buffer.write(timeStr + ''.ljust(4) + name + '\n')
+        self.buffered += 1
+        if self.buffered >= OUTPUT_BLOCK_SIZE or \
+                time.monotonic() - self.lastWrite >= PROGRESS_INTERVAL:
+            self.flush()
+    
+    def flush(self):
+        """write buffered listing and progress line"""
+        out = ''
+        if self.buffered:
+            listing = self.buffer.getvalue()
+            self.buffer.seek(0)
+            self.buffer.truncate()
+            self.buffered = 0
+            if self.format != 'text':
+                print(listing, end='', file=sys.stdout)
+            elif self.noProgress:
+                out = listing
+            else:
+                # listing overwrites progress line, which is then shown again
+                out = '\r' + ''.ljust(40) + '\r' + listing
+                self.shown = None
+        if not self.noProgress and self.printed != self.shown:
+            out += '\rScanning files trashed on ' + self.printed
+            self.shown = self.printed
+        if out:
+            print(out, end='')
+        self.lastWrite = time.monotonic()
     
     def clear_line(self):
-        print('\r' + ''.ljust(40) + '\r', end='')
-        print()
+        self.flush()
+        print('\r' + ''.ljust(40) + '\r')
 
 class PathFinder:
-    def __init__(self, service, cache=None):
+    class _Entry:
+        """Cached file: name, parent id and number of times queried"""
+        __slots__ = ('name', 'parentId', 'count')
+        def __init__(self, name, parentId, count=0):
+            self.name = name
+            self.parentId = parentId
+            self.count = count
+    
+    def __init__(self, service, cache=None, maxSize=PATH_CACHE_SIZE):
         self.service = service
-    # each item in self.cache is a list with 2 elements
-    # self.cache[id][0] is the full path of id
-    # self.cache[id][1] is the number of times id has been queried
-        if cache:
-            self.cache = cache
-        else:
-            self.cache = dict()
+    # self.cache maps id to PathFinder._Entry, least recently used first
+    # full paths are built by following parentId up the folder tree
+        self.cache = collections.OrderedDict(cache or ())
+        self.maxSize = maxSize
     # self.expanded contains all ids that have all their children cached
         self.expanded = set()
     
+    @stats.phase('paths')
     def get_path(self, id, fileRes=None):
         """Find the full path for id
         
@@ -405,20 +1818,87 @@ class PathFinder:
                     Must have 'name' and 'parents' attributes if available.
                     If None or unspecified, an API call is made to query"""
         if id in self.cache:
-            if self.cache[id][1]>1 and id not in self.expanded:
+            entry = self.cache[id]
+            if entry.count>1 and id not in self.expanded:
                 # find and cache all children if id is requested more than once
                 self.expand_cache(id)
-            self.cache[id][1] += 1
-            return self.cache[id][0]
+            entry.count += 1
+            return self._build_path(id)
         if not fileRes:
             request = self.service.files().get(fileId=id, fields='name,parents')
             fileRes = execute_request(request)
-        try:
-            parentId = fileRes['parents'][0]
-            self.cache[id] = [self.get_path(parentId) + os.sep + fileRes['name'], 1]
-        except KeyError:
-            self.cache[id] = [fileRes['name'], 1]
-        return self.cache[id][0]
+        self._add(id, fileRes, 1)
+        return self._build_path(id)
+    
+    def _build_path(self, id):
+        names = []
+        while id is not None:
+            if id not in self.cache:
+                # ancestor evicted from cache
+                names.append(self.get_path(id))
+                break
+            self.cache.move_to_end(id)
+            entry = self.cache[id]
+            names.append(entry.name)
+            id = entry.parentId
+        return os.sep.join(reversed(names))
+    
+    def _add(self, id, fileRes, count=0):
+        parents = fileRes.get('parents')
+        self.cache[id] = PathFinder._Entry(fileRes['name'], parents[0] if parents else None, count)
+        self.cache.move_to_end(id)
+        while len(self.cache) > self.maxSize:
+            evicted, _ = self.cache.popitem(last=False)
+            self.expanded.discard(evicted)
+    
+    @stats.phase('paths')
+    def prefetch(self, fileResList):
+        """Find and cache parents of all files in fileResList, up to the root
+        
+        fileResList:    File resources. Must have 'parents' attributes if 
+                        available.
+        Uncached parent folders are queried level by level up the folder 
+        tree, up to BATCH_SIZE at a time in batch HTTP requests, instead of 
+        one request per folder by get_path().
+        """
+        level = {fileRes['parents'][0] for fileRes in fileResList if fileRes.get('parents')}
+        files = self.service.files()
+        while level:
+            level = [id for id in level if id not in self.cache]
+            parents = set()
+            for start in range(0, len(level), BATCH_SIZE):
+                chunk = level[start:start+BATCH_SIZE]
+                requests = [files.get(fileId=id, fields='name,parents') for id in chunk]
+                for id, response in zip(chunk, execute_batch(self.service, requests)):
+                    # leave inaccessible folders to get_path()
+                    if isinstance(response, Exception):
+                        continue
+                    self._add(id, response)
+                    if response.get('parents'):
+                        parents.add(response['parents'][0])
+            level = parents
+    
+    @stats.phase('paths')
+    def load_folder_tree(self, timeout=TIMEOUT_DEFAULT):
+        """Query all folders in Google Drive at once, in one paged listing
+        
+        Afterwards, paths of files can be found with few or no API calls.
+        """
+        npt = None
+        while True:
+            request = self.service.files().list(
+                    q="mimeType='application/vnd.google-apps.folder'",
+                    pageToken=npt,
+                    fields="files(id,name,parents),nextPageToken",
+                    pageSize=1000)
+            response = execute_request(request, timeout)
+            for file in response['files']:
+                if file['id'] not in self.cache:
+                    self._add(file['id'], file)
+            try:
+                npt = response['nextPageToken']
+            except KeyError:
+                break
     
     def expand_cache(self, id):
         if id in self.expanded:
@@ -434,33 +1914,495 @@ class PathFinder:
             for file in response['files']:
                 if file['id'] in self.cache:
                     continue
-                self.cache[file['id']] = [self.cache[id][0] + os.sep + file['name'], 0]
+                self._add(file['id'], {'name': file['name'], 'parents': [id]})
             try:
                 npt = response['nextPageToken']
             except KeyError:
                 break
         self.expanded.add(id)
     
-    def clear():
+    def apply_changes(self, items):
+        """Update cached files renamed, moved or removed in Drive change list
+        
+        items:  'changes' in the response of changes().list()
+        """
+        for item in items:
+            entry = self.cache.get(item['fileId'])
+            if entry is None:
+                continue
+            file = item.get('file')
+            if item.get('removed') or not file:
+                del self.cache[item['fileId']]
+                self.expanded.discard(item['fileId'])
+                continue
+            entry.name = file['name']
+            if 'parents' in file:
+                entry.parentId = file['parents'][0] if file['parents'] else None
+    
+    def load(self, path):
+        """Load cached folders saved by save(). Silently ignore a bad file"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                folders = json.load(f)
+            for id, name, parentId in folders:
+                self.cache[id] = PathFinder._Entry(name, parentId)
+        except (OSError, ValueError, TypeError):
+            return
+        while len(self.cache) > self.maxSize:
+            self.cache.popitem(last=False)
+    
+    def save(self, path):
+        """Save cached folders to file, replacing it atomically
+        
+        Only ids that are parents of other cached ids are saved.
+        """
+        parentIds = {entry.parentId for entry in self.cache.values()}
+        folders = [[id, entry.name, entry.parentId] for id, entry in self.cache.items()
+                    if id in parentIds]
+        tempPath = path + '.tmp'
+        with open(tempPath, 'w', encoding='utf-8') as f:
+            json.dump(folders, f, separators=(',', ':'))
+        os.replace(tempPath, path)
+    
+    def clear(self):
         self.cache.clear()
+        self.expanded.clear()
 
-def execute_request(request, timeout=TIMEOUT_DEFAULT):
+def execute_request(request, timeout=TIMEOUT_DEFAULT, http=None, limiter=None):
     """Execute Google API request
     Automatic retry upon Google backend error (500) until timeout
+    
+    http:       Http object to execute with instead of the request's own.
+    limiter:    RateLimiter to throttle the request with. If specified, rate 
+                limit errors (403, 429) are also retried until timeout.
     """
+    endpoint = getattr(request, 'methodId', None) or 'unknown'
     while timeout >= 0:
+        if limiter:
+            limiter.acquire()
+        start = time.perf_counter()
         try:
-            response = request.execute()
+            response = request.execute(http=http)
         except HttpError as e:
+            stats.record_call(endpoint, time.perf_counter() - start, e.args[0]['status'])
             if int(e.args[0]['status']) == 500:
+                stats.record_retry('backendError', RETRY_INTERVAL)
+                timeout -= RETRY_INTERVAL
+                time.sleep(RETRY_INTERVAL)
+                continue
+            if limiter and is_rate_limit_error(e):
+                stats.record_retry('rateLimit', RETRY_INTERVAL)
+                limiter.backoff()
                 timeout -= RETRY_INTERVAL
                 time.sleep(RETRY_INTERVAL)
                 continue
             raise e
+        except Exception as e:
+            stats.record_call(endpoint, time.perf_counter() - start, type(e).__name__)
+            raise
         else:
+            stats.record_call(endpoint, time.perf_counter() - start)
+            if limiter:
+                limiter.succeed()
             return response
     raise TimeoutError
 
+def is_rate_limit_error(e):
+    """Check if HttpError e is caused by exceeding Google API rate limits"""
+    status = int(e.args[0]['status'])
+    if status == 429:
+        return True
+    if status != 403:
+        return False
+    try:
+        errors = json.loads(e.content.decode('utf-8'))['error']['errors']
+        return any(error.get('reason') in RATE_LIMIT_REASONS for error in errors)
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return False
+
+def is_not_found_error(e):
+    """Check if HttpError e is caused by the file not existing (any more)"""
+    return int(e.args[0]['status']) == 404
+
+class RateLimiter:
+    """Token bucket shared by threads to throttle API requests
+    
+    The rate (requests per second) doubles about every second of successful 
+    requests until the first rate limit error (slow start). From then on, 
+    it's halved upon rate limit errors, and increased by about RATE_STEP 
+    for every second of successful requests.
+    """
+    def __init__(self, rate=RATE_INITIAL, minRate=RATE_MIN, maxRate=RATE_MAX):
+        self.rate = rate
+        self.minRate = minRate
+        self.maxRate = maxRate
+        self.slowStart = True
+        self.tokens = 1.0
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """Block until a request is allowed"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                # bucket capacity is 1 second worth of requests
+                self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            stats.record_throttle(wait)
+            time.sleep(wait)
+    
+    def backoff(self):
+        with self.lock:
+            self.rate = max(self.minRate, self.rate / 2)
+            self.tokens = 0.0
+            self.slowStart = False
+    
+    def succeed(self):
+        with self.lock:
+            if self.slowStart:
+                self.rate = min(self.maxRate, self.rate + 1)
+            else:
+                self.rate = min(self.maxRate, self.rate + RATE_STEP / self.rate)
+
+class AsyncDriveService:
+    """Google Drive API service object running on asyncio and aiohttp
+    
+    Drop-in replacement for the service object built by build_service(), 
+    for the API methods used by this script. Requests are sent from an event 
+    loop in a separate thread over pooled connections, with at most 
+    maxConcurrent requests in flight. request.execute() only blocks the 
+    calling thread, so requests from multiple threads run concurrently, as 
+    do all requests in a batch from new_batch_http_request().
+    Errors are raised as HttpError, same as the blocking service object, so 
+    execute_request() and execute_batch() retry them the same way. Failed 
+    connections are raised as httplib2.ServerNotFoundError, other aiohttp 
+    errors as httplib2.HttpLib2Error, and requests not done in timeout 
+    seconds as TimeoutError, for clean() to handle.
+    """
+    class _Request:
+        def __init__(self, service, method, path, params, methodId):
+            self.service = service
+            self.method = method
+            self.path = path
+            self.params = params
+            self.methodId = methodId
+        
+        def execute(self, http=None, num_retries=0):
+            """Execute the request and return the response. http is ignored"""
+            response = self.service.execute_all([self])[0]
+            if isinstance(response, Exception):
+                raise response
+            return response
+    
+    class _Batch:
+        def __init__(self, service, callback):
+            self.service = service
+            self.callback = callback
+            self.requests = []
+        
+        def add(self, request, callback=None, request_id=None):
+            self.requests.append((request, callback or self.callback, request_id))
+        
+        def execute(self, http=None):
+            """Execute all requests concurrently and call their callbacks"""
+            responses = self.service.execute_all([request for request, _, _ in self.requests])
+            for (request, callback, requestId), response in zip(self.requests, responses):
+                if isinstance(response, HttpError):
+                    callback(requestId, None, response)
+                elif isinstance(response, Exception):
+                    raise response
+                else:
+                    callback(requestId, response, None)
+    
+    class _Changes:
+        def __init__(self, service):
+            self.service = service
+        
+        def getStartPageToken(self, **params):
+            return AsyncDriveService._Request(self.service, 'GET', 'changes/startPageToken',
+                                              params, 'drive.changes.getStartPageToken')
+        
+        def list(self, **params):
+            return AsyncDriveService._Request(self.service, 'GET', 'changes', params,
+                                              'drive.changes.list')
+    
+    class _Files:
+        def __init__(self, service):
+            self.service = service
+        
+        def get(self, fileId, **params):
+            return AsyncDriveService._Request(self.service, 'GET', 'files/' + quote(fileId, safe=''),
+                                              params, 'drive.files.get')
+        
+        def list(self, **params):
+            return AsyncDriveService._Request(self.service, 'GET', 'files', params,
+                                              'drive.files.list')
+        
+        def delete(self, fileId, **params):
+            return AsyncDriveService._Request(self.service, 'DELETE', 'files/' + quote(fileId, safe=''),
+                                              params, 'drive.files.delete')
+    
+    def __init__(self, credentials=None, baseUrl=DRIVE_API_URL, maxConcurrent=ASYNC_CONCURRENCY,
+                 timeout=TIMEOUT_DEFAULT):
+        if aiohttp is None:
+            raise ImportError('aiohttp is required by the async backend')
+        self.credentials = credentials
+        self.baseUrl = baseUrl
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self._run(self._open(maxConcurrent, timeout))
+    
+    def changes(self):
+        return AsyncDriveService._Changes(self)
+    
+    def files(self):
+        return AsyncDriveService._Files(self)
+    
+    def new_batch_http_request(self, callback=None):
+        return AsyncDriveService._Batch(self, callback)
+    
+    def execute_all(self, requests):
+        """Execute requests concurrently
+        
+        Return a list of responses in the same order as requests. A request 
+        failed with an exception has the exception as response.
+        Access token is refreshed once if it's rejected (401).
+        """
+        responses = self._run(self._send_all(requests, self._get_token()))
+        expired = [i for i, response in enumerate(responses)
+                    if isinstance(response, HttpError) and int(response.args[0]['status']) == 401]
+        if expired and self.credentials:
+            self.credentials.refresh(httplib2.Http())
+            retried = self._run(self._send_all([requests[i] for i in expired], self._get_token()))
+            for i, response in zip(expired, retried):
+                responses[i] = response
+        return responses
+    
+    def close(self):
+        self._run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+    
+    def _get_token(self):
+        if not self.credentials:
+            return None
+        return self.credentials.get_access_token().access_token
+    
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+    
+    async def _open(self, maxConcurrent, timeout):
+        self.semaphore = asyncio.Semaphore(maxConcurrent)
+        self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=maxConcurrent),
+                timeout=aiohttp.ClientTimeout(total=timeout))
+    
+    async def _send_all(self, requests, token):
+        return await asyncio.gather(*(self._send(request, token) for request in requests),
+                                    return_exceptions=True)
+    
+    async def _send(self, request, token):
+        headers = {'Authorization': 'Bearer ' + token} if token else {}
+        params = {key: str(value).lower() if isinstance(value, bool) else str(value)
+                    for key, value in request.params.items() if value is not None}
+        async with self.semaphore:
+            try:
+                async with self.session.request(request.method, self.baseUrl + request.path,
+                                                params=params, headers=headers) as resp:
+                    content = await resp.read()
+                    status = resp.status
+                    uri = str(resp.url)
+            except aiohttp.ClientConnectionError as e:
+                raise httplib2.ServerNotFoundError(str(e))
+            except asyncio.TimeoutError:
+                raise TimeoutError
+            except aiohttp.ClientError as e:
+                raise httplib2.HttpLib2Error(str(e))
+        if status >= 300:
+            raise HttpError(httplib2.Response({'status': status}), content, uri=uri)
+        return json.loads(content.decode('utf-8')) if content else ''
+
+class ThreadHttp(threading.local):
+    """Separate authorized Http object for each thread
+    
+    httplib2.Http is not thread-safe. Access ThreadHttp().http from 
+    any thread to get the one belonging to the current thread.
+    """
+    def __init__(self, credentials=None):
+        self.http = httplib2.Http()
+        if credentials:
+            self.http = credentials.authorize(self.http)
+
+def can_use_threads(service, credentials):
+    """Check if requests of service can be sent from other threads
+    
+    The async backend's service takes requests from any thread. Otherwise 
+    each thread needs its own Http object, authorized with credentials.
+    """
+    return isinstance(service, AsyncDriveService) or credentials is not None
+
+def sequential_delete(service, items, timeout=TIMEOUT_DEFAULT, http=None):
+    """Delete files one by one
+    
+    Generator. Yield each item in `items` after it's deleted, in input order.
+    """
+    files = service.files()
+    for item in items:
+        request = files.delete(fileId = item.fileId)
+        try:
+            execute_request(request, timeout, http)
+        except HttpError as e:
+            if not is_not_found_error(e):
+                raise
+        yield item
+
+def batch_delete(service, items, timeout=TIMEOUT_DEFAULT, http=None):
+    """Delete files in batches of up to BATCH_SIZE per HTTP request
+    
+    Generator. Yield each item in `items` after it's deleted, in input order.
+    items:      Iterable of TrashedFile.
+    timeout:    Timeout in seconds for each batch.
+    http:       Http object to execute batches with instead of service's own.
+    Any error other than those retried by execute_batch() and file not 
+    found (404) is raised after the items deleted in its batch are yielded.
+    """
+    files = service.files()
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, BATCH_SIZE))
+        if not chunk:
+            break
+        requests = [files.delete(fileId=item.fileId) for item in chunk]
+        error = None
+        for item, response in zip(chunk, execute_batch(service, requests, timeout, http)):
+            if not isinstance(response, Exception) or \
+                    isinstance(response, HttpError) and is_not_found_error(response):
+                yield item
+            elif error is None:
+                error = response
+        if error is not None:
+            raise error
+
+def execute_batch(service, requests, timeout=TIMEOUT_DEFAULT, http=None):
+    """Execute up to BATCH_SIZE Google API requests in one batch HTTP request
+    
+    responses = execute_batch(service, requests, timeout, http)
+    
+    Automatic retry of requests that failed with Google backend error (500) 
+    or rate limit errors (403, 429) until timeout. Retries after rate limit 
+    errors are spaced out twice as long each time.
+    http:       Http object to execute the batch with instead of service's own.
+    responses:  List of responses in the same order as requests. A request 
+                failed with any other error has the HttpError as response, 
+                and one still failing at timeout has a TimeoutError.
+    """
+    responses = [None] * len(requests)
+    pending = list(range(len(requests)))
+    interval = RETRY_INTERVAL
+    while pending:
+        failed = []
+        limited = []
+        def callback(requestId, response, exception):
+            i = int(requestId)
+            endpoint = getattr(requests[i], 'methodId', None) or 'unknown'
+            if exception is None:
+                responses[i] = response
+                stats.record_call(endpoint)
+            elif isinstance(exception, HttpError) and int(exception.args[0]['status']) == 500:
+                failed.append(i)
+                stats.record_call(endpoint, error=500)
+            elif isinstance(exception, HttpError) and is_rate_limit_error(exception):
+                limited.append(i)
+                stats.record_call(endpoint, error=exception.args[0]['status'])
+            else:
+                responses[i] = exception
+                stats.record_call(endpoint, error=exception.args[0]['status']
+                                  if isinstance(exception, HttpError) else type(exception).__name__)
+        batch = service.new_batch_http_request(callback=callback)
+        for i in pending:
+            batch.add(requests[i], request_id=str(i))
+        start = time.perf_counter()
+        try:
+            batch.execute(http=http)
+        except HttpError as e:
+            stats.record_call('batch', time.perf_counter() - start, e.args[0]['status'])
+            if is_rate_limit_error(e):
+                limited = pending
+            elif int(e.args[0]['status']) == 500:
+                failed = pending
+            else:
+                raise e
+        else:
+            stats.record_call('batch', time.perf_counter() - start)
+        pending = sorted(failed + limited)
+        if not pending:
+            break
+        if timeout < 0:
+            for i in pending:
+                responses[i] = TimeoutError()
+            break
+        if limited:
+            stats.record_retry('rateLimit', interval, len(limited))
+        if failed:
+            stats.record_retry('backendError', interval, len(failed))
+        sleep = interval
+        if limited:
+            interval *= 2
+        timeout -= sleep
+        time.sleep(sleep)
+    return responses
+
+def parallel_delete(service, items, workers, timeout=TIMEOUT_DEFAULT,
+                    credentials=None, limiter=None):
+    """Delete files concurrently in `workers` threads
+    
+    Generator. Yield each item in `items` after it's deleted, in input order.
+    items:          Iterable of TrashedFile. Up to 2*workers of them are 
+                    queued for deletion at a time.
+    credentials:    Credentials to authorize each thread's Http object with.
+    limiter:        RateLimiter shared by all threads. A new one by default.
+    Deletion stops as soon as any request fails, and the error is raised.
+    """
+    limiter = limiter or RateLimiter()
+    threadHttp = ThreadHttp(credentials)
+    files = service.files()
+    stop = threading.Event()
+    def delete(item):
+        if stop.is_set():
+            return
+        try:
+            request = files.delete(fileId=item.fileId)
+            execute_request(request, timeout, threadHttp.http, limiter)
+        except HttpError as e:
+            if not is_not_found_error(e):
+                stop.set()
+                raise
+        except BaseException:
+            stop.set()
+            raise
+    delete = safePrinter.inherit(delete)
+    with ThreadPoolExecutor(workers) as executor:
+        try:
+            queued = collections.deque()
+            for item in items:
+                queued.append((item, executor.submit(delete, item)))
+                if len(queued) >= 2*workers:
+                    item, future = queued.popleft()
+                    future.result()
+                    yield item
+            for item, future in queued:
+                future.result()
+                yield item
+        finally:
+            stop.set()
+
 def ask_usr_confirmation(n):
     while True:
         if n == 1:
@@ -474,9 +2416,53 @@ def ask_usr_confirmation(n):
 
 def parse_time(rfc3339):
     """parse the RfC 3339 time given by Google into Unix time"""
+    if is_google_time(rfc3339):
+        # fast path for the format Google always uses
+        return calendar.timegm((int(rfc3339[0:4]), int(rfc3339[5:7]), int(rfc3339[8:10]),
+                                int(rfc3339[11:13]), int(rfc3339[14:16]), int(rfc3339[17:19])))
     time_str = rfc3339.split('.')[0]
     return calendar.timegm(time.strptime(time_str, '%Y-%m-%dT%H:%M:%S'))
 
+def is_google_time(rfc3339):
+    """check if rfc3339 is in the format given by Google, 
+    yyyy-mm-ddThh:mm:ss[.fff]Z, which sorts as a string in time order"""
+    return len(rfc3339) >= 20 and rfc3339[-1] == 'Z' and rfc3339[19] in '.Z' and \
+           rfc3339[4] == rfc3339[7] == '-' and rfc3339[10] == 'T' and \
+           rfc3339[13] == rfc3339[16] == ':' and rfc3339[:4].isdigit()
+
+class TimeCutoff:
+    """Cutoff time to classify RFC 3339 times given by Google
+    
+    A time is after the cutoff if parse_time() of it is greater than 
+    unixTime. Times in Google's format are compared to the cutoff rendered 
+    in the same format as strings, without parsing.
+    """
+    def __init__(self, unixTime):
+        self.unixTime = unixTime
+        self.string = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(unixTime))
+    
+    def after(self, rfc3339):
+        if is_google_time(rfc3339):
+            # parse_time() ignores fractions of a second
+            return rfc3339[:19] > self.string
+        return parse_time(rfc3339) > self.unixTime
+    
+    def split(self, items):
+        """Find the first of `items` made after the cutoff by binary search
+        
+        items:  'changes' in the response of changes().list(), which are in 
+                ascending order of time.
+        Return its index, or len(items) if there's none.
+        """
+        lo, hi = 0, len(items)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.after(items[mid]['time']):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
 if __name__ == '__main__':
     try:
         main()